@@ -0,0 +1,70 @@
+# Compares applying a batch of writes to a max table row by row through its view with a single call of
+# its max_<table>_<mrv>_batch function (both in one transaction)
+# Usage: python3 batch_writes.py <model-yml> [<keys>] [<writes>]
+# (only the connection settings, initialNodes, maxNodes and rkLayout of the model are used; the tables
+# are created in the 'mrv_bench' schema, which is dropped at the end)
+
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+from converter_utils import apply_defaults, connect, convert_table
+from max_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+
+
+def setup(model, keys):
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, stock int)')
+    cursor.execute('INSERT INTO items SELECT i, 0 FROM generate_series(1, %s) AS i', (keys,))
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['stock']},
+                  (prepare_table, load_table, index_table, finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    return conn, cursor
+
+
+def row_by_row(conn, cursor, writes):
+    for id, value in writes:
+        cursor.execute('UPDATE items SET stock = %s WHERE id = %s', (value, id))
+    conn.commit()
+
+
+def batch(conn, cursor, writes):
+    cursor.execute('SELECT max_items_stock_batch(%s, %s)', ([id for id, _ in writes], [value for _, value in writes]))
+    conn.commit()
+
+
+def measure(name, function, conn, cursor, writes):
+    start = time.perf_counter()
+    function(conn, cursor, writes)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>10}: {elapsed:.3f}s ({len(writes) / elapsed:.0f} writes/s)')
+    return elapsed
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000
+count = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000
+
+print(f'keys: {keys}, writes: {count}, initialNodes: {model["initialNodes"]}, rkLayout: {model["rkLayout"]}')
+conn, cursor = setup(model, keys)
+# increasing values, so that every write updates its node in both runs
+writes = [(random.randint(1, keys), value) for value in range(1, count + 1)]
+single = measure('row by row', row_by_row, conn, cursor, writes)
+writes = [(id, value + count) for id, value in writes]
+batched = measure('batch', batch, conn, cursor, writes)
+print(f'speedup: {single / batched:.1f}x')
+cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+conn.commit()
+conn.close()
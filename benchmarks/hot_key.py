@@ -0,0 +1,79 @@
+# Measures the latency of concurrent writes to a single hot key of a max table, each transaction
+# holding its node for a while, and how many of them found every node locked and had to wait
+# Usage: python3 hot_key.py <model-yml> [<clients>] [<writes-per-client>] [<hold-ms>]
+# (only the connection settings, initialNodes and maxNodes of the model are used; the tables are
+# created in the 'mrv_bench' schema, which is dropped at the end; compare with initialNodes 1 to see
+# the writes queueing on a single node)
+
+import itertools
+import random
+import sys
+import os
+import threading
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+from converter_utils import apply_defaults, connect, convert_table
+from max_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+# increasing values, so that every write updates its node
+values = itertools.count(1)
+
+
+def setup(model):
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, stock int)')
+    cursor.execute('INSERT INTO items VALUES (1, 0)')
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['stock']},
+                  (prepare_table, load_table, index_table, finish_table))
+    conn.commit()
+    conn.close()
+
+
+def client(model, writes, hold, latencies):
+    conn, cursor = connect(model)
+    for _ in range(writes):
+        start = time.perf_counter()
+        cursor.execute('SELECT max_items_stock(1, %s, %s)',
+                       (random.randint(0, model['maxNodes']), next(values)))
+        time.sleep(hold)
+        conn.commit()
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+clients = int(sys.argv[2]) if len(sys.argv) >= 3 else 8
+writes = int(sys.argv[3]) if len(sys.argv) >= 4 else 200
+hold = (float(sys.argv[4]) if len(sys.argv) >= 5 else 1) / 1000
+
+print(f'clients: {clients}, writes per client: {writes}, hold: {hold * 1000:.1f}ms, '
+      f'initialNodes: {model["initialNodes"]}')
+setup(model)
+latencies = []
+threads = [threading.Thread(target=client, args=(model, writes, hold, latencies)) for _ in range(clients)]
+start = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+elapsed = time.perf_counter() - start
+
+latencies.sort()
+print(f'{len(latencies) / elapsed:.0f} writes/s, mean {sum(latencies) / len(latencies) * 1000:.3f}ms, '
+      f'p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms')
+conn, cursor = connect(model)
+cursor.execute(f"SELECT coalesce(last_value, 0) FROM pg_sequences WHERE schemaname = '{schema}' "
+               "AND sequencename = 'items_stock_waits'")
+print(f'writes that waited for a locked node: {cursor.fetchone()[0]}')
+cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+conn.commit()
+conn.close()
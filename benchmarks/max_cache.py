@@ -0,0 +1,75 @@
+# Compares full scans and single key reads of the view of a max table, and the latency of its max_
+# write function, converted without and with maxCache
+# Usage: python3 max_cache.py <model-yml> [<keys>] [<writes>]
+# (only the connection settings, initialNodes, maxNodes and rkLayout of the model are used; the tables
+# are created in the 'mrv_bench' schema, which is dropped at the end)
+
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+from converter_utils import apply_defaults, connect, convert_table, catalog
+from max_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+scans = 20
+
+
+# creates and converts the benchmark table, with or without the max cache
+def setup(model, keys, cache):
+    model = dict(model, maxCache=cache)
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, stock int)')
+    cursor.execute('INSERT INTO items SELECT i, 0 FROM generate_series(1, %s) AS i', (keys,))
+    catalog.clear()
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['stock']},
+                  (prepare_table, load_table, index_table, finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    conn.autocommit = True
+    return conn, cursor
+
+
+def measure(name, cursor, statement, args):
+    latencies = []
+    for values in args:
+        start = time.perf_counter()
+        cursor.execute(statement, values)
+        cursor.fetchall()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    print(f'{name:>10}: mean {mean * 1000:.3f}ms, p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms')
+    return mean
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000
+writes = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000
+# increasing values, so that every write updates its node (and the cache)
+args = [(random.randint(1, keys), random.randint(0, model['maxNodes']), value) for value in range(1, writes + 1)]
+reads = [(id,) for id, _, _ in args]
+
+print(f'keys: {keys}, writes: {writes}, initialNodes: {model["initialNodes"]}, maxNodes: {model["maxNodes"]}')
+results = {}
+for cache in (False, True):
+    conn, cursor = setup(model, keys, cache)
+    print(f'maxCache: {str(cache).lower()}')
+    results[cache] = measure('write', cursor, 'SELECT max_items_stock(%s, %s, %s)', args)
+    results[cache, 'read'] = measure('read', cursor, 'SELECT * FROM items WHERE id = %s', reads)
+    results[cache, 'scan'] = measure('scan', cursor, 'SELECT sum(stock) FROM items', [()] * scans)
+    if cache:
+        cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+    conn.close()
+print(f"with vs without maxCache: scan {results[False, 'scan'] / results[True, 'scan']:.2f}x, "
+      f"read {results[False, 'read'] / results[True, 'read']:.2f}x, write {results[False] / results[True]:.2f}x")
@@ -0,0 +1,84 @@
+# Compares reading single keys, and batches of keys, of a max, topk or ntopk table through its view
+# with its point lookup functions (<table>_<structure>(<pk>) and <table>_<structure>_batch(<pk>[]))
+# Usage: python3 point_lookup.py <model-yml> <max|topk|ntopk> [<keys>] [<reads>] [<batch-size>]
+# (only the connection settings, initialNodes and maxNodes of the model are used; the tables are
+# created in the 'mrv_bench' schema, which is dropped at the end)
+
+import importlib
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mrvx_structures', 'ntopk'))
+from converter_utils import apply_defaults, connect, convert_table
+
+schema = 'mrv_bench'
+# table, rows and table_data of each structure
+structures = {
+    'max': ('CREATE TABLE items (id int PRIMARY KEY, stock int)',
+            'INSERT INTO items SELECT i, mod(i, 1000) FROM generate_series(1, %s) AS i',
+            {'name': 'items', 'mrv': ['stock']}),
+    'topk': ('CREATE TABLE items (id int PRIMARY KEY, stock int[])',
+             'INSERT INTO items SELECT i, ARRAY[mod(i, 1000), mod(i, 37), mod(i, 11)] FROM generate_series(1, %s) AS i',
+             {'name': 'items', 'mrv': ['stock']}),
+    'ntopk': ('CREATE TABLE items (id int PRIMARY KEY, pos int, player varchar(20), stock int)',
+              "INSERT INTO items SELECT i, 1, 'p' || i, mod(i, 1000) FROM generate_series(1, %s) AS i",
+              {'name': 'items', 'mrv': ['stock'], 'payload': ['player'], 'order': ['pos']}),
+}
+
+
+def setup(model, structure, keys):
+    create, insert, table_data = structures[structure]
+    converter = importlib.import_module(f'{structure}_converter')
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute(create)
+    cursor.execute(insert, (keys,))
+    convert_table(conn, cursor, model, table_data,
+                  (converter.prepare_table, converter.load_table, converter.index_table, converter.finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    conn.autocommit = True
+    return conn, cursor
+
+
+def measure(name, cursor, statement, args):
+    latencies = []
+    for values in args:
+        start = time.perf_counter()
+        cursor.execute(statement, values)
+        cursor.fetchall()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    print(f'{name:>14}: mean {mean * 1000:.3f}ms, p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms')
+    return mean
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+structure = sys.argv[2]
+keys = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000
+reads = int(sys.argv[4]) if len(sys.argv) >= 5 else 1000
+batch_size = int(sys.argv[5]) if len(sys.argv) >= 6 else 100
+single = [(random.randint(1, keys),) for _ in range(reads)]
+batches = [([random.randint(1, keys) for _ in range(batch_size)],) for _ in range(max(reads // batch_size, 10))]
+
+print(f'structure: {structure}, keys: {keys}, reads: {reads}, batch size: {batch_size}, '
+      f'initialNodes: {model["initialNodes"]}, maxNodes: {model["maxNodes"]}')
+conn, cursor = setup(model, structure, keys)
+view = measure('view', cursor, 'SELECT * FROM items WHERE id = %s', single)
+function = measure(f'items_{structure}', cursor, f'SELECT * FROM items_{structure}(%s)', single)
+view_batch = measure('view batch', cursor, 'SELECT * FROM items WHERE id = ANY(%s)', batches)
+function_batch = measure(f'items_{structure}_batch', cursor, f'SELECT * FROM items_{structure}_batch(%s)', batches)
+print(f'function vs view: single key {view / function:.2f}x, batch {view_batch / function_batch:.2f}x')
+cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+conn.close()
@@ -0,0 +1,67 @@
+# Compares the latency of the max_ write function of a max table converted with the 'sparse' and the
+# 'dense' rkLayout (random keys, one write per transaction)
+# Usage: python3 rk_layout.py <model-yml> [<keys>] [<writes>]
+# (only the connection settings, initialNodes and maxNodes of the model are used; the tables are
+# created in the 'mrv_bench' schema, which is dropped at the end)
+
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+from converter_utils import apply_defaults, connect, convert_table, catalog
+from max_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+
+
+# creates and converts the benchmark table with the given rk layout
+def setup(model, keys, layout):
+    model = dict(model, rkLayout=layout)
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, stock int)')
+    cursor.execute('INSERT INTO items SELECT i, 0 FROM generate_series(1, %s) AS i', (keys,))
+    catalog.clear()
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['stock']},
+                  (prepare_table, load_table, index_table, finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    conn.autocommit = True
+    return conn, cursor
+
+
+def measure(name, cursor, args):
+    latencies = []
+    for values in args:
+        start = time.perf_counter()
+        cursor.execute('SELECT max_items_stock(%s, %s, %s)', values)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    print(f'{name:>7}: mean {mean * 1000:.3f}ms, p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms')
+    return mean
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000
+writes = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000
+args = [(random.randint(1, keys), random.randint(0, model['maxNodes']), value) for value in range(1, writes + 1)]
+
+print(f'keys: {keys}, writes: {writes}, initialNodes: {model["initialNodes"]}, maxNodes: {model["maxNodes"]}')
+results = {}
+for layout in ('sparse', 'dense'):
+    conn, cursor = setup(model, keys, layout)
+    results[layout] = measure(layout, cursor, args)
+    if layout == 'dense':
+        cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+    conn.close()
+print(f"dense vs sparse: {results['sparse'] / results['dense']:.2f}x")
@@ -0,0 +1,49 @@
+# Compares the rk sampling loop previously used by the converters with the vectorized sampler
+# Usage: python3 rk_sampling.py [<keys>] [<max-nodes>] [<initial-nodes>]
+
+import random
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from converter_utils import sample_rks
+
+
+# per key list of free rks + random removal, as the converters did before
+def legacy_loop(keys, max_nodes, initial_nodes):
+    samples = []
+    for _ in range(keys):
+        rks = [x for x in range(max_nodes)]
+        sample = []
+        for _ in range(initial_nodes):
+            rk = rks[random.randrange(len(rks))]
+            rks.remove(rk)
+            sample.append(rk)
+        samples.append(sample)
+    return samples
+
+
+def vectorized(keys, max_nodes, initial_nodes, batch_size=10000):
+    samples = []
+    for start in range(0, keys, batch_size):
+        samples.extend(sample_rks(min(batch_size, keys - start), max_nodes, initial_nodes).tolist())
+    return samples
+
+
+def measure(name, function, *args):
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>12}: {elapsed:.3f}s ({args[0] / elapsed:.0f} keys/s)')
+    return elapsed
+
+
+keys = int(sys.argv[1]) if len(sys.argv) >= 2 else 100000
+max_nodes = int(sys.argv[2]) if len(sys.argv) >= 3 else 1024
+initial_nodes = int(sys.argv[3]) if len(sys.argv) >= 4 else 20
+
+print(f'keys: {keys}, maxNodes: {max_nodes}, initialNodes: {initial_nodes}')
+legacy = measure('legacy loop', legacy_loop, keys, max_nodes, initial_nodes)
+new = measure('vectorized', vectorized, keys, max_nodes, initial_nodes)
+print(f'speedup: {legacy / new:.1f}x')
@@ -0,0 +1,89 @@
+# Compares a refresh round of the serial worker that scans every key of <table>_<mrv>_pk and refreshes
+# each one with draining only the keys queued by the node consumption function
+# (refresh_<table>_<mrv>_dirty), after consuming a node of 0.1%, 1% and 10% of the keys
+# Usage: python3 serial_dirty.py <model-yml> [<keys>] [<batch-size>]
+# (only the connection settings, initialNodes and maxNodes of the model are used; the tables are
+# created in the 'mrv_bench' schema, which is dropped at the end)
+
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mrvx_structures', 'serial'))
+from converter_utils import apply_defaults, connect, convert_table
+from serial_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+
+
+def setup(model, keys):
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, counter int)')
+    cursor.execute('INSERT INTO items SELECT i, 0 FROM generate_series(1, %s) AS i', (keys,))
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['counter']},
+                  (prepare_table, load_table, index_table, finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    return conn, cursor
+
+
+# consumes a node of each of the given keys, in a single transaction
+def consume(conn, cursor, ids):
+    for id in ids:
+        cursor.execute('SELECT * FROM items_counter(%s)', (id,))
+    conn.commit()
+
+
+# the previous worker round: every key, one transaction each
+def scan(conn, cursor, batch_size):
+    cursor.execute('SELECT * FROM items_counter_pk')
+    for id, in cursor.fetchall():
+        cursor.execute('SELECT refresh_items_counter(%s)', (id,))
+        conn.commit()
+    # not part of this round, but its keys stay queued otherwise
+    cursor.execute('DELETE FROM items_counter_dirty')
+    conn.commit()
+
+
+# the current worker round: the queued keys, one batch per transaction
+def drain(conn, cursor, batch_size):
+    refreshed = 1
+    while refreshed > 0:
+        cursor.execute('SELECT refresh_items_counter_dirty(%s)', (batch_size,))
+        refreshed, = cursor.fetchone()
+        conn.commit()
+
+
+def measure(name, function, conn, cursor, batch_size):
+    start = time.perf_counter()
+    function(conn, cursor, batch_size)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>6}: {elapsed * 1000:.1f}ms')
+    return elapsed
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000
+batch_size = int(sys.argv[3]) if len(sys.argv) >= 4 else 1000
+
+print(f'keys: {keys}, batch size: {batch_size}, initialNodes: {model["initialNodes"]}')
+conn, cursor = setup(model, keys)
+for fraction in (0.001, 0.01, 0.1):
+    consumed = max(int(keys * fraction), 1)
+    print(f'consumed keys: {consumed}')
+    consume(conn, cursor, random.sample(range(1, keys + 1), consumed))
+    scanned = measure('scan', scan, conn, cursor, batch_size)
+    consume(conn, cursor, random.sample(range(1, keys + 1), consumed))
+    drained = measure('drain', drain, conn, cursor, batch_size)
+    print(f'drain vs scan: {scanned / drained:.1f}x')
+cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+conn.commit()
+conn.close()
@@ -0,0 +1,71 @@
+# Measures the time the worker refresh of a serial table takes per key, calling refresh_<table>_<mrv>
+# once per key and refresh_<table>_<mrv>_batch once for all the keys, for 1, 10 and 100 consumed
+# (invalid) nodes per key
+# Usage: python3 serial_refresh.py <model-yml> [<keys>]
+# (only the connection settings of the model are used; every key gets 101 nodes, and the tables are
+# created in the 'mrv_bench' schema, which is dropped at the end)
+
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mrvx_structures', 'serial'))
+from converter_utils import apply_defaults, connect, convert_table
+from serial_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+nodes = 101
+
+
+def setup(model, keys):
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, counter int)')
+    cursor.execute('INSERT INTO items SELECT i, 0 FROM generate_series(1, %s) AS i', (keys,))
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['counter']},
+                  (prepare_table, load_table, index_table, finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    conn.autocommit = True
+    return conn, cursor
+
+
+# consumes the 'consumed' nodes of every key with the lowest rks
+def consume(cursor, consumed):
+    cursor.execute('UPDATE items_counter AS T SET valid = FALSE FROM ('
+                   'SELECT id, rk, ROW_NUMBER() OVER (PARTITION BY id ORDER BY rk) AS i FROM items_counter) AS S '
+                   'WHERE T.id = S.id AND T.rk = S.rk AND S.i <= %s', (consumed,))
+    cursor.execute('VACUUM ANALYZE items_counter')
+
+
+def measure(name, cursor, statements, keys):
+    start = time.perf_counter()
+    for statement, values in statements:
+        cursor.execute(statement, values)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>10}: {elapsed:.3f}s ({elapsed / keys * 1000:.3f}ms per key)')
+    return elapsed
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+model['initialNodes'] = nodes
+model['maxNodes'] = nodes - 1
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+
+print(f'keys: {keys}, nodes per key: {nodes}')
+conn, cursor = setup(model, keys)
+for consumed in (1, 10, 100):
+    print(f'consumed nodes per key: {consumed}')
+    consume(cursor, consumed)
+    single = measure('per key', cursor, [('SELECT refresh_items_counter(%s)', (id,)) for id in range(1, keys + 1)], keys)
+    consume(cursor, consumed)
+    batch = measure('batch', cursor, [('SELECT refresh_items_counter_batch(%s)', (list(range(1, keys + 1)),))], keys)
+    print(f'batch vs per key: {single / batch:.1f}x')
+cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+conn.close()
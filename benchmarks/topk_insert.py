@@ -0,0 +1,82 @@
+# Measures the latency of the topK_ write function of a topk table, and the tuple versions (updates
+# and dead tuples of its node table) each write leaves behind, for k = 5, 50 and 500
+# Usage: python3 topk_insert.py <model-yml> [<keys>] [<writes>]
+# (only the connection settings and maxNodes of the model are used; every key gets a single node,
+# converted already holding k values, and every write inserts a new largest value, the worst case of
+# an insert that shifts the array; the tables are created in the 'mrv_bench' schema, which is
+# dropped at the end)
+
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+from converter_utils import apply_defaults, connect, convert_table, catalog
+import topk_converter
+
+schema = 'mrv_bench'
+
+
+# creates and converts the benchmark table, each key holding k values
+def setup(model, keys, k):
+    topk_converter.k = k
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, stock int[])')
+    cursor.execute('INSERT INTO items SELECT i, ARRAY(SELECT generate_series(1, %s)) FROM generate_series(1, %s) AS i',
+                   (k, keys))
+    catalog.clear()
+    convert_table(conn, cursor, model, {'name': 'items', 'mrv': ['stock']},
+                  (topk_converter.prepare_table, topk_converter.load_table, topk_converter.index_table,
+                   topk_converter.finish_table))
+    # keep the dead tuples around to be counted
+    cursor.execute('ALTER TABLE items_stock SET (autovacuum_enabled = false)')
+    cursor.execute('ANALYZE')
+    conn.commit()
+    conn.autocommit = True
+    return conn, cursor
+
+
+# updated tuples (HOT or not) and dead tuples of the node table
+def tuple_stats(cursor):
+    cursor.execute('SELECT pg_stat_force_next_flush()')
+    cursor.execute('SELECT pg_stat_clear_snapshot()')
+    cursor.execute(f"SELECT n_tup_upd, n_dead_tup FROM pg_stat_user_tables WHERE schemaname = '{schema}' "
+                   "AND relname = 'items_stock'")
+    return cursor.fetchone()
+
+
+def measure(k, cursor, args):
+    updated, dead = tuple_stats(cursor)
+    latencies = []
+    for values in args:
+        start = time.perf_counter()
+        cursor.execute('SELECT topK_items_stock(%s, %s, %s)', values)
+        latencies.append(time.perf_counter() - start)
+    updated_after, dead_after = tuple_stats(cursor)
+    latencies.sort()
+    print(f'k={k:<4}: mean {sum(latencies) / len(latencies) * 1000:.3f}ms, '
+          f'p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms, '
+          f'{(updated_after - updated) / len(args):.1f} updated and {(dead_after - dead) / len(args):.1f} dead tuples per write')
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+model['initialNodes'] = 1
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 1000
+writes = int(sys.argv[3]) if len(sys.argv) >= 4 else 5000
+
+print(f'keys: {keys}, writes: {writes}')
+for k in (5, 50, 500):
+    conn, cursor = setup(model, keys, k)
+    # increasing values, each one larger than every value of its node
+    args = [(random.randint(1, keys), random.randint(0, model['maxNodes']), k + value) for value in range(1, writes + 1)]
+    measure(k, cursor, args)
+    cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+    conn.close()
@@ -0,0 +1,72 @@
+# Compares the latency of single row UPDATEs through the view of a max table converted with the
+# 'rule' and the 'trigger' writePath, and of calling its max_ function directly
+# Usage: python3 write_path.py <model-yml> [<keys>] [<updates>]
+# (only the connection settings, initialNodes and maxNodes of the model are used; the tables are
+# created in the 'mrv_bench' schema, which is dropped at the end)
+
+import random
+import sys
+import os
+import time
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'specialized_structures'))
+from converter_utils import apply_defaults, connect, convert_table, catalog
+from max_converter import prepare_table, load_table, index_table, finish_table
+
+schema = 'mrv_bench'
+table_data = {'name': 'items', 'mrv': ['stock']}
+
+
+# creates and converts the benchmark table with the given write path
+def setup(model, keys, write_path):
+    model = dict(model, writePath=write_path)
+    conn, cursor = connect(model)
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, info varchar(32), stock int)')
+    cursor.execute('INSERT INTO items SELECT i, md5(i::text), 0 FROM generate_series(1, %s) AS i', (keys,))
+    catalog.clear()
+    convert_table(conn, cursor, model, table_data, (prepare_table, load_table, index_table, finish_table))
+    cursor.execute('ANALYZE')
+    conn.commit()
+    conn.autocommit = True
+    return conn, cursor
+
+
+def measure(name, cursor, statement, args):
+    latencies = []
+    for values in args:
+        start = time.perf_counter()
+        cursor.execute(statement, values)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    mean = sum(latencies) / len(latencies)
+    print(f'{name:>16}: mean {mean * 1000:.3f}ms, p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms')
+    return mean
+
+
+with open(sys.argv[1]) as f:
+    model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+model['schema'] = schema
+keys = int(sys.argv[2]) if len(sys.argv) >= 3 else 10000
+updates = int(sys.argv[3]) if len(sys.argv) >= 4 else 10000
+args = [(random.randint(1, 1000000), random.randint(1, keys)) for _ in range(updates)]
+
+print(f'keys: {keys}, updates: {updates}, initialNodes: {model["initialNodes"]}, maxNodes: {model["maxNodes"]}')
+results = {}
+for write_path in ('rule', 'trigger'):
+    conn, cursor = setup(model, keys, write_path)
+    results[write_path] = measure(f'{write_path} UPDATE', cursor,
+                                  'UPDATE items SET stock = %s WHERE id = %s', args)
+    if write_path == 'trigger':
+        # the per-structure function the write path ends up calling, without going through the view
+        results['direct'] = measure('max_items_stock', cursor,
+                                    f"SELECT max_items_stock(%s, FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer, %s)",
+                                    [(id, value) for value, id in args])
+        cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+    conn.close()
+print(f"trigger vs rule: {results['rule'] / results['trigger']:.2f}x")
@@ -0,0 +1,1425 @@
+# Helpers shared by the MRV converters (PostgreSQL only)
+
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import execute_values
+from psycopg2.extensions import quote_ident
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+from itertools import islice
+import numpy as np
+import argparse
+import csv
+import datetime
+import functools
+import io
+import json
+import os
+import pickle
+import random
+import struct
+import time
+import yaml
+
+
+# default values of the optional model parameters
+model_defaults = {
+    'fetchSize': 10000,
+    'insertBatchSize': 10000,
+    'loader': 'copy',
+    'copyFormat': 'text',
+    'nodeGeneration': 'python',
+    'chunkRows': 50000,
+    'onlineChunkPause': 0,
+    'onlineLockTimeout': '5s',
+    'maintenanceWorkMem': None,
+    'maintenanceWorkers': None,
+    'unloggedLoad': False,
+    'verifyChecksums': False,
+    'writePath': 'trigger',
+    'rkLayout': 'sparse',
+    'maxCache': False,
+    'elideWrites': False,
+    'countElisions': False,
+}
+
+# accepted values of the optional model parameters that select a mode
+model_choices = {
+    'loader': ('copy', 'insert'),
+    'copyFormat': ('text', 'binary'),
+    'nodeGeneration': ('python', 'sql'),
+    'writePath': ('trigger', 'rule'),
+    'rkLayout': ('sparse', 'dense'),
+}
+
+
+def apply_defaults(model):
+    for key, value in model_defaults.items():
+        model.setdefault(key, value)
+    for key, choices in model_choices.items():
+        if model[key] not in choices:
+            exit(f"Invalid value '{model[key]}' for '{key}' (expected one of: {', '.join(choices)})")
+    return model
+
+
+# command line shared by the converters
+def parse_args():
+    parser = argparse.ArgumentParser(
+        usage='python3 <converter.py> <model-yml> [<initial-nodes>] [--jobs N] [--ranges N] [--online] '
+              '[--checkpoint] [--resume] [--catalog FILE] [--emit-sql FILE] [--ingest TABLE FILE]')
+    parser.add_argument('model', help='model file')
+    parser.add_argument('initial_nodes', nargs='?', type=int, help='overrides initialNodes')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of tables converted concurrently, each in its own connection')
+    parser.add_argument('--ranges', type=int, default=1,
+                        help='number of primary key ranges each table is split into and loaded '
+                             'concurrently (overridden by the \'ranges\' of a table in the model)')
+    parser.add_argument('--online', action='store_true',
+                        help='keeps the tables writable while they are converted, capturing their changes '
+                             'and swapping the views in at the end')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='commits every step (and chunk of rows) of a conversion, recording it in the '
+                             'mrv_journal table')
+    parser.add_argument('--resume', action='store_true',
+                        help='continues a checkpointed conversion from the last step recorded in the '
+                             'journal (implies --checkpoint)')
+    parser.add_argument('--catalog', metavar='FILE',
+                        help='snapshot of the description of the tables: read from FILE if it exists, '
+                             'otherwise read from the database and saved to FILE')
+    parser.add_argument('--emit-sql', metavar='FILE',
+                        help='writes the whole conversion to a SQL script instead of running it')
+    parser.add_argument('--ingest', nargs=2, metavar=('TABLE', 'FILE'),
+                        help='loads the rows of the CSV file FILE (with a header naming its columns) into the '
+                             'already converted TABLE, through an UNLOGGED staging table')
+    return parser.parse_args()
+
+
+def load_model(args):
+    with open(args.model) as f:
+        model = apply_defaults(yaml.load(f, Loader=yaml.FullLoader))
+    if args.initial_nodes is not None:
+        model['initialNodes'] = min(args.initial_nodes, model['maxNodes'])
+    return model
+
+
+def connect(model):
+    conn = psycopg2.connect(dbname=model['database'], host=model['host'], port=model['port'],
+                            user=model['user'], password=model['password'])
+    cursor = conn.cursor()
+    cursor.execute(f"SET search_path TO {model['schema']}")
+    return conn, cursor
+
+
+type_translation = {
+    'character': 'varchar',
+    'smallint': 'integer'
+}
+
+# column in a relation
+class Column:
+    __slots__ = ('name', 'type', 'nullable')
+
+    def __init__(self, name, type, nullable):
+        self.name = name
+        self.type = type_translation.get(type, type)
+        self.nullable = nullable
+
+    def __repr__(self):
+        return f'name: {self.name}, type: {self.type}, nullable: {self.nullable}'
+
+
+# table described from the catalog: its columns as (name, data_type, udt_name, nullable), with the
+# type names of information_schema.columns, the names of its primary key columns and the
+# definitions of its indexes
+class Table:
+    __slots__ = ('name', 'attributes', 'primary_key', 'indexes')
+
+    def __init__(self, name, attributes, primary_key, indexes):
+        self.name = name
+        self.attributes = attributes
+        self.primary_key = primary_key
+        self.indexes = indexes
+
+    # columns typed with their SQL standard type names (data_type) or, with udt_names=True,
+    # with the internal ones (udt_name)
+    def columns(self, udt_names=False):
+        return [Column(name, udt_name if udt_names else data_type, nullable)
+                for name, data_type, udt_name, nullable in self.attributes]
+
+
+# descriptions of the tables already read from the catalog, by name
+catalog = {}
+
+# columns, primary key and indexes of the given tables of a schema; the type names are computed
+# as information_schema.columns does (data_type and udt_name), without its cost on large catalogs
+catalog_query = '''
+    SELECT c.relname,
+           (SELECT json_agg(json_build_array(
+                       a.attname,
+                       CASE WHEN t.typtype = 'd' THEN
+                           CASE WHEN bt.typelem <> 0 AND bt.typlen = -1 THEN 'ARRAY'
+                                WHEN bt.typnamespace = 'pg_catalog'::regnamespace THEN format_type(t.typbasetype, NULL)
+                                ELSE 'USER-DEFINED' END
+                       ELSE
+                           CASE WHEN t.typelem <> 0 AND t.typlen = -1 THEN 'ARRAY'
+                                WHEN t.typnamespace = 'pg_catalog'::regnamespace THEN format_type(a.atttypid, NULL)
+                                ELSE 'USER-DEFINED' END
+                       END,
+                       coalesce(bt.typname, t.typname),
+                       NOT (a.attnotnull OR (t.typtype = 'd' AND t.typnotnull)))
+                   ORDER BY a.attnum)
+            FROM pg_attribute a
+            JOIN pg_type t ON t.oid = a.atttypid
+            LEFT JOIN pg_type bt ON t.typtype = 'd' AND bt.oid = t.typbasetype
+            WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped),
+           ARRAY(SELECT a.attname
+                 FROM pg_index i
+                 JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                 WHERE i.indrelid = c.oid AND i.indisprimary),
+           ARRAY(SELECT pg_get_indexdef(i.indexrelid)
+                 FROM pg_index i
+                 WHERE i.indrelid = c.oid
+                 ORDER BY i.indexrelid)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = %s AND c.relname = ANY(%s) AND c.relkind IN ('r', 'p')
+'''
+
+
+# reads the description of several tables from the catalog with a single query
+def describe_tables(cursor, schema, names):
+    cursor.execute(catalog_query, (schema, list(names)))
+    for name, attributes, primary_key, indexes in cursor.fetchall():
+        catalog[name] = Table(name, [tuple(x) for x in attributes], primary_key, indexes)
+    return {name: catalog[name] for name in names if name in catalog}
+
+
+# description of a table of the model, read from the catalog if it was not read before
+def describe_table(cursor, model, name):
+    if name not in catalog:
+        describe_tables(cursor, model['schema'], [name])
+    if name not in catalog:
+        exit(f"Table '{name}' not found in schema '{model['schema']}'")
+    return catalog[name]
+
+
+# saves the descriptions of the given tables, read from the catalog, to a JSON snapshot
+def save_catalog(path, schema, names):
+    tables = {name: {'attributes': catalog[name].attributes, 'primary_key': catalog[name].primary_key,
+                     'indexes': catalog[name].indexes}
+              for name in names if name in catalog}
+    with open(path, 'w') as f:
+        json.dump({'schema': schema, 'tables': tables}, f, indent=2, sort_keys=True)
+
+
+# reads the descriptions of the tables from a JSON snapshot written by save_catalog
+def load_catalog(path, schema):
+    with open(path) as f:
+        snapshot = json.load(f)
+    if snapshot['schema'] != schema:
+        exit(f"The catalog snapshot '{path}' describes schema '{snapshot['schema']}', not '{schema}'")
+    for name, table in snapshot['tables'].items():
+        catalog[name] = Table(name, [tuple(x) for x in table['attributes']], table['primary_key'],
+                              table['indexes'])
+
+
+# functions used by the workers, shared by all the converted tables
+helper_functions = {
+    # create mrv size function
+    'mrv_size': '''
+        CREATE OR REPLACE FUNCTION mrv_size(tablename varchar, columnname varchar, pk varchar) RETURNS int
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE ret int;
+        BEGIN
+            EXECUTE 'SELECT count(*) FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
+            RETURN ret;
+        END
+        $$;
+    ''',
+    # create mrv total function
+    'mrv_total': '''
+        CREATE OR REPLACE FUNCTION mrv_total(tablename varchar, columnname varchar, pk varchar) RETURNS numeric
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE ret numeric;
+        BEGIN
+            EXECUTE 'SELECT sum(' || columnname || ') FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
+            RETURN ret;
+        END
+        $$;
+    ''',
+}
+
+
+# PL/pgSQL that locks into rk_v a node of the key (the '<key>_' parameters) where 'condition' holds:
+# the first unlocked one from rk_ onwards, wrapping around, or, when all are locked, the first one,
+# counting the wait in <mrv table>_waits; with the dense rkLayout a node drawn from the n nodes of the
+# key is probed first. rk_v is left NULL when no node satisfies 'condition'
+def select_node(model, mrv_table, keys, condition='TRUE'):
+    match = ' AND '.join(f'{key} = {key}_' for key in keys)
+    where = f'{match} AND {condition}'
+    dense = ''
+    if model['rkLayout'] == 'dense':
+        dense = f'''
+                rk_ := coalesce((SELECT FLOOR(RANDOM() * n)::integer FROM {mrv_table}_nodes WHERE {match}), rk_);
+
+                SELECT rk INTO rk_v
+                FROM {mrv_table}
+                WHERE {where} AND rk = rk_
+                FOR UPDATE SKIP LOCKED;
+
+                IF rk_v IS NULL THEN'''
+    sparse = f'''
+                SELECT rk INTO rk_v
+                FROM {mrv_table}
+                WHERE {where} AND rk >= rk_
+                ORDER BY rk
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED;
+
+                IF rk_v IS NULL THEN
+                    SELECT rk INTO rk_v
+                    FROM {mrv_table}
+                    WHERE {where} AND rk < rk_
+                    ORDER BY rk
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED;
+                END IF;
+
+                IF rk_v IS NULL THEN
+                    -- every node is locked (or there are none)
+                    SELECT rk INTO rk_v FROM(
+                        (SELECT rk
+                            FROM {mrv_table}
+                            WHERE {where} AND rk >= rk_
+                            ORDER BY rk
+                            LIMIT 1)
+                            UNION ALL
+                            (SELECT MIN(rk)
+                            FROM {mrv_table}
+                            WHERE {where})
+                        ) AS T
+                    LIMIT 1;
+                    IF rk_v IS NOT NULL THEN
+                        PERFORM nextval('{mrv_table}_waits');
+                    END IF;
+                END IF;
+    '''
+    if dense:
+        return dense + sparse + '''
+                END IF;
+    '''
+    return sparse
+
+
+# statement of the _batch write functions: 'batch' has one row per key (the 'keys' and the new 'values'),
+# and each key locks one node as select_node does, updated with 'assignments' where 'condition' holds;
+# the updated nodes are stored in d and the waits in waits. 'then' is evaluated per updated node and
+# 'elide' is the (bound_table, condition on the key G and its bound E) of elide_write
+def batch_update(model, mrv_table, keys, values, batch, assignments, condition, then=None, elide=None):
+    on = ' AND '.join(f'T.{key} = N.{key}' for key in keys) + f' AND {condition}'
+    updated = f'count({then})' if then is not None else 'count(*)'
+    given, counted = '', ''
+    if elide is not None and model['elideWrites']:
+        bound_table, skip = elide
+        given = f'''given AS (
+                    SELECT G.*, EXISTS (SELECT 1 FROM {bound_table} AS E
+                                        WHERE {' AND '.join(f'E.{key} = G.{key}' for key in keys)} AND {skip}) AS elided
+                    FROM ({batch}) AS G
+                ), '''
+        batch = f'''
+                    SELECT {', '.join(keys + values)} FROM given WHERE NOT elided'''
+        if model['countElisions']:
+            counted = f''',
+                       (SELECT count(nextval('{mrv_table}_writes')) FROM given),
+                       (SELECT count(CASE WHEN elided THEN nextval('{mrv_table}_elided') END) FROM given)'''
+    if model['rkLayout'] == 'dense':
+        starts = f'''SELECT B.*, FLOOR(RANDOM() * C.n)::integer AS r
+                    FROM batch AS B JOIN {mrv_table}_nodes AS C USING ({', '.join(keys)})'''
+    else:
+        starts = f'''SELECT B.*, FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer AS r
+                    FROM batch AS B'''
+    statement = f'''
+                WITH {given}batch AS ({batch}
+                ), starts AS (
+                    {starts}
+                ), locked AS (
+                    SELECT N.*, (SELECT rk FROM {mrv_table} AS T WHERE {on}
+                                 ORDER BY rk < N.r, rk LIMIT 1 FOR UPDATE SKIP LOCKED) AS rk
+                    FROM starts AS N
+                ), nodes AS (
+                    SELECT {', '.join(f'N.{column}' for column in keys + values)},
+                           coalesce(N.rk, (SELECT rk FROM {mrv_table} AS T WHERE {on}
+                                           ORDER BY rk < N.r, rk LIMIT 1)) AS rk,
+                           N.rk IS NULL AS waited
+                    FROM locked AS N
+                ), updated AS (
+                    UPDATE {mrv_table} AS T
+                    SET {assignments}
+                    FROM nodes AS N
+                    WHERE {' AND '.join(f'T.{key} = N.{key}' for key in keys)} AND T.rk = N.rk AND {condition}
+                    RETURNING {', '.join(f'T.{column}' for column in keys + values)}
+                )
+                SELECT (SELECT {updated} FROM updated),
+                       (SELECT count(nextval('{mrv_table}_waits')) FROM nodes WHERE waited AND rk IS NOT NULL){counted}
+                INTO d, waits{', writes_, elided_' if counted else ''};
+    '''
+    if counted:
+        return f'''
+                DECLARE writes_ int; elided_ int;
+                BEGIN{statement}
+                END;
+    '''
+    return statement
+
+
+# with elideWrites, the start of a write function that returns without touching any node when
+# 'condition' holds for the bound of the key (the '<key>_' parameters) in 'bound_table'; with
+# countElisions, the writes and the elided ones are counted in <mrv table>_writes and _elided
+def elide_write(model, mrv_table, keys, bound_table, condition):
+    if not model['elideWrites']:
+        return ''
+    count = model['countElisions']
+    return f'''
+                {f"PERFORM nextval('{mrv_table}_writes');" if count else ''}
+                IF EXISTS (SELECT 1 FROM {bound_table} WHERE {' AND '.join(f'{key} = {key}_' for key in keys)} AND {condition}) THEN
+                    {f"PERFORM nextval('{mrv_table}_elided');" if count else ''}
+                    RETURN;
+                END IF;
+'''
+
+
+# with elideWrites, the function raise_<mrv table>_bound(<pk>_, <column>_) that raises the bound of a
+# key to a value just written, unless another write holds its row (a lower bound is still a bound);
+# it returns TRUE, to be counted per updated node by batch_update
+def bound_function(mrv_table, pk, column, type):
+    key = ' AND '.join(f'{key.name} = {key.name}_' for key in pk)
+    return f'''
+        CREATE OR REPLACE FUNCTION raise_{mrv_table}_bound({', '.join(f'{key.name}_ {key.type}' for key in pk)}, {column}_ {type}) RETURNS boolean
+        AS $$
+        BEGIN
+            UPDATE {mrv_table}_bound
+            SET {column} = {column}_
+            WHERE ctid = (SELECT ctid FROM {mrv_table}_bound
+                          WHERE {key} AND ({column} IS NULL OR {column}_ > {column})
+                          FOR UPDATE SKIP LOCKED);
+            RETURN TRUE;
+        END
+        $$ LANGUAGE plpgsql;
+    '''
+
+
+# with countElisions, statements that create the counters of elide_write and the <mrv table>_elision
+# view, with the number of writes, of elided writes and their ratio
+def elision_counters(model, mrv_table):
+    if not (model['elideWrites'] and model['countElisions']):
+        return []
+    counter = "CASE WHEN is_called THEN last_value ELSE 0 END"
+    return [f'CREATE SEQUENCE IF NOT EXISTS {mrv_table}_writes',
+            f'CREATE SEQUENCE IF NOT EXISTS {mrv_table}_elided', f'''
+        CREATE OR REPLACE VIEW {mrv_table}_elision AS
+        SELECT W.writes, E.elided, E.elided::float / NULLIF(W.writes, 0) AS hit_rate
+        FROM (SELECT {counter} AS writes FROM {mrv_table}_writes) AS W,
+             (SELECT {counter} AS elided FROM {mrv_table}_elided) AS E
+    ''']
+
+
+# statements that send the writes to the view of a table to its insert_, update_ and delete_ functions,
+# called with the given arguments (built from NEW and OLD): an INSTEAD OF row trigger or, with the
+# 'rule' writePath, one DO INSTEAD rule per operation
+def write_path(model, table, insert_args, update_args, delete_args):
+    if model['writePath'] == 'rule':
+        return [f'''
+            CREATE OR REPLACE RULE "insert_{table}_rule" AS
+            ON INSERT TO {table}
+            DO INSTEAD SELECT insert_{table}({insert_args})
+        ''', f'''
+            CREATE OR REPLACE RULE "update_{table}_rule" AS
+            ON UPDATE TO {table}
+            DO INSTEAD SELECT update_{table}({update_args})
+        ''', f'''
+            CREATE OR REPLACE RULE "delete_{table}_rule" AS
+            ON DELETE TO {table}
+            DO INSTEAD SELECT delete_{table}({delete_args})
+        ''']
+    return [f'''
+        CREATE OR REPLACE FUNCTION {table}_write() RETURNS trigger
+        AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                PERFORM insert_{table}({insert_args});
+                RETURN NEW;
+            ELSIF TG_OP = 'UPDATE' THEN
+                PERFORM update_{table}({update_args});
+                RETURN NEW;
+            END IF;
+            PERFORM delete_{table}({delete_args});
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql;
+    ''', f'''
+        DROP TRIGGER IF EXISTS {table}_write ON {table}
+    ''', f'''
+        CREATE TRIGGER {table}_write
+        INSTEAD OF INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE {table}_write()
+    ''']
+
+
+# statements that create the point lookups of the view of a table: <name>(<pk>) returns its rows of
+# one key and <name>_batch(<pk>[]) the ones of the keys in the arrays (one per primary key column);
+# rows(match) builds the query of the view rows whose <table>_orig row (aliased alias) satisfies
+# match(alias), which must only read the nodes of those rows. Being single SELECT sql functions,
+# they are inlined into the calling query when used in its FROM (SELECT * FROM <name>(...))
+def lookup_functions(table, name, pk, rows):
+    def key(alias):
+        return ' AND '.join(f'{alias}.{x.name} = {x.name}_' for x in pk)
+
+    def keys(alias):
+        if len(pk) == 1:
+            return f'{alias}.{pk[0].name} = ANY({pk[0].name}_)'
+        return (f"({', '.join(f'{alias}.{x.name}' for x in pk)}) IN "
+                f"(SELECT * FROM unnest({', '.join(f'{x.name}_' for x in pk)}))")
+
+    return [f'''
+        CREATE OR REPLACE FUNCTION {name}({', '.join(f'{x.name}_ {x.type}' for x in pk)}) RETURNS SETOF {table}
+        AS $$
+            {rows(key)}
+        $$ LANGUAGE sql STABLE;
+    ''', f'''
+        CREATE OR REPLACE FUNCTION {name}_batch({', '.join(f'{x.name}_ {x.type}[]' for x in pk)}) RETURNS SETOF {table}
+        AS $$
+            {rows(keys)}
+        $$ LANGUAGE sql STABLE;
+    ''']
+
+
+# converts a table in a single transaction with the phases of a converter:
+# prepare_table(cursor, model, table_data) -> data, load_table(conn, cursor, model, table_data, data),
+# index_table(cursor, model, table_data, data) -> statements and finish_table(cursor, model, table_data, data);
+# the new tables are loaded without primary keys or indexes, which are only built afterwards
+def convert_table(conn, cursor, model, table_data, phases):
+    prepare_table, load_table, index_table, finish_table = phases
+    data = prepare_table(cursor, model, table_data, primary_keys=False)
+    load_table(conn, cursor, model, table_data, data)
+    build_indexes(cursor, model, index_table(cursor, model, table_data, data))
+    set_logged(cursor, model, data)
+    verify_checksums(cursor, model, table_data, data)
+    finish_table(cursor, model, table_data, data)
+
+
+# settings of the sessions that build the primary keys and indexes
+def maintenance_settings(model):
+    settings = {}
+    if model['maintenanceWorkMem'] is not None:
+        settings['maintenance_work_mem'] = model['maintenanceWorkMem']
+    if model['maintenanceWorkers'] is not None:
+        settings['max_parallel_maintenance_workers'] = model['maintenanceWorkers']
+    return settings
+
+
+# runs the statements returned by index_table (one list per table) in the current transaction
+def build_indexes(cursor, model, statements):
+    settings = maintenance_settings(model)
+    for name, value in settings.items():
+        cursor.execute(f'SET LOCAL {name} = %s', (str(value),))
+    for table_statements in statements:
+        for statement in table_statements:
+            cursor.execute(statement)
+    for name in settings:
+        cursor.execute(f'SET LOCAL {name} TO DEFAULT')
+
+
+# runs the statements returned by index_table concurrently, the ones of each table in a worker
+# process with its own connection and transaction
+def build_indexes_concurrently(model, statements):
+    statements = [table_statements for table_statements in statements if table_statements]
+    if not statements:
+        return
+    failed = []
+    with ProcessPoolExecutor(max_workers=len(statements)) as pool:
+        futures = [pool.submit(run_job, model, build_indexes_job, model, table_statements)
+                   for table_statements in statements]
+        for future in futures:
+            elapsed, error = future.result()
+            if error is not None:
+                failed.append(error)
+    if failed:
+        exit(f"Failed to build {len(failed)} index(es): {'; '.join(failed)}")
+
+
+def build_indexes_job(conn, cursor, model, statements):
+    build_indexes(cursor, model, [statements])
+
+
+# makes the new tables, created unlogged with 'unloggedLoad', logged once they are loaded and indexed
+def set_logged(cursor, model, data):
+    if model['unloggedLoad']:
+        for shadow in data['shadows']:
+            cursor.execute(f'ALTER TABLE {shadow} SET LOGGED')
+
+
+# with 'verifyChecksums', compares the count and the sum of the hashes of the distinct rows of the
+# original table with the ones copied to '{table}_orig', and the distinct keys of the original table
+# with the ones of every MRV table, exiting if they differ
+def verify_checksums(cursor, model, table_data, data):
+    if not model['verifyChecksums']:
+        return
+    table = table_data['name']
+    checks = []
+    for shadow in data['shadows']:
+        columns = data['not_mrv'] if shadow == f'{table}_orig' else data['pk']
+        checks.append((shadow, ', '.join(column.name for column in columns)))
+    for shadow, columns in checks:
+        checksums = []
+        for source in (data['source'], shadow):
+            cursor.execute(f'''
+                SELECT count(*), coalesce(sum(hashtextextended(R::text, 0)), 0)
+                FROM (SELECT DISTINCT {columns} FROM {source}) AS R
+            ''')
+            checksums.append(cursor.fetchone())
+        if checksums[0] != checksums[1]:
+            exit(f"Checksum of '{shadow}' ({checksums[1][0]} rows) differs from the one of "
+                 f"'{data['source']}' ({checksums[0][0]} rows)")
+    print(f"Checksums of '{table}' verified")
+
+
+# converts every table of the model, after creating the shared helper functions; with a single
+# job everything runs in one transaction, otherwise each table is converted by a worker process
+# in its own connection and transaction; tables split in primary key ranges, online and checkpointed
+# conversions are committed in steps
+def convert_model(model, phases, helpers, args):
+    ranges = {table_data['name']: table_data.get('ranges', args.ranges) for table_data in model['tables']}
+    checkpoint = args.checkpoint or args.resume
+    if args.jobs > 1 and any(count > 1 for count in ranges.values()):
+        exit('--jobs cannot be combined with tables split in ranges')
+    if (args.online or checkpoint) and any(count > 1 for count in ranges.values()):
+        exit('--online and --checkpoint cannot be combined with tables split in ranges')
+    if args.online and checkpoint:
+        exit('--online cannot be combined with --checkpoint')
+    if checkpoint and model['unloggedLoad']:
+        exit('--checkpoint cannot be combined with unloggedLoad: a crash of the server empties '
+             'the unlogged tables of the steps already recorded')
+    if args.emit_sql is not None and (args.jobs > 1 or args.online or checkpoint
+                                      or any(count > 1 for count in ranges.values())):
+        exit('--emit-sql cannot be combined with --jobs, --online, --checkpoint or tables split in ranges')
+    if args.ingest is not None:
+        if args.jobs > 1 or args.online or checkpoint or args.emit_sql is not None:
+            exit('--ingest cannot be combined with --jobs, --online, --checkpoint or --emit-sql')
+        tables = {table_data['name']: table_data for table_data in model['tables']}
+        if args.ingest[0] not in tables:
+            exit(f"Table '{args.ingest[0]}' is not in the model")
+        conn, cursor = connect(model)
+        ingest_table(conn, cursor, model, tables[args.ingest[0]], phases, args.ingest[1])
+        conn.commit()
+        conn.close()
+        print('Done')
+        return
+    if args.online:
+        convert = convert_table_online
+    elif checkpoint:
+        convert = functools.partial(convert_table_checkpoint, resume=args.resume)
+    else:
+        convert = convert_table
+
+    names = [table_data['name'] for table_data in model['tables']]
+    conn = None
+    if args.catalog is not None and os.path.exists(args.catalog):
+        load_catalog(args.catalog, model['schema'])
+    else:
+        conn, cursor = connect(model)
+        describe_tables(cursor, model['schema'], names)
+        if args.catalog is not None:
+            save_catalog(args.catalog, model['schema'], names)
+    missing = [name for name in names if name not in catalog]
+    if missing and args.resume:
+        # tables already renamed (or replaced by their view) by a prepared checkpointed conversion
+        # are resumed with the description recorded in the journal
+        if conn is None:
+            conn, cursor = connect(model)
+        cursor.execute("SELECT to_regclass('mrv_journal') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT table_name FROM mrv_journal WHERE step = 'prepare' AND table_name = ANY(%s)",
+                           (missing,))
+            journaled = {name for name, in cursor.fetchall()}
+            missing = [name for name in missing if name not in journaled]
+    if missing:
+        exit(f"Table(s) not found in schema '{model['schema']}': {', '.join(missing)}")
+
+    if args.emit_sql is not None:
+        if conn is not None:
+            conn.close()
+        emit_script(model, phases, helpers, args.emit_sql)
+        return
+
+    if conn is None:
+        conn, cursor = connect(model)
+    for helper in helpers:
+        cursor.execute(helper_functions[helper])
+    if checkpoint:
+        cursor.execute(journal_table)
+
+    if args.jobs <= 1:
+        for table_data in model['tables']:
+            if ranges[table_data['name']] > 1:
+                conn.commit()
+                convert_table_ranges(conn, cursor, model, table_data, phases, ranges[table_data['name']])
+            else:
+                convert(conn, cursor, model, table_data, phases)
+        conn.commit()
+        conn.close()
+        print('Done')
+        return
+
+    conn.commit()
+    conn.close()
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(convert_table_job, model, table_data, phases, convert)
+                   for table_data in model['tables']]
+        for done, future in enumerate(as_completed(futures), 1):
+            table, elapsed, error = future.result()
+            if error is None:
+                print(f"[{done}/{len(futures)}] Table '{table}' converted in {elapsed:.2f}s")
+            else:
+                failed.append(table)
+                print(f"[{done}/{len(futures)}] Table '{table}' failed after {elapsed:.2f}s: {error}")
+    if failed:
+        exit(f"Failed to convert {len(failed)} table(s): {', '.join(failed)}")
+    print('Done')
+
+
+# runs a function in its own connection and transaction, returning (elapsed time, error)
+def run_job(model, function, *args):
+    start = time.time()
+    conn, cursor = connect(model)
+    try:
+        function(conn, cursor, *args)
+        conn.commit()
+        error = None
+    except Exception as e:
+        conn.rollback()
+        error = f'{type(e).__name__}: {e}'.strip()
+    finally:
+        conn.close()
+    return time.time() - start, error
+
+
+def convert_table_job(model, table_data, phases, convert):
+    return (table_data['name'],) + run_job(model, convert, model, table_data, phases)
+
+
+def load_range_job(model, table_data, data, load_table, where):
+    return (where,) + run_job(model, load_table, model, table_data, data, where)
+
+
+# converts a table whose rows are split in primary key ranges loaded concurrently, each by a
+# worker process in its own connection; the new tables are created (without primary keys) and
+# committed first, and the primary keys and indexes are only built after every range is loaded
+def convert_table_ranges(conn, cursor, model, table_data, phases, count):
+    prepare_table, load_table, index_table, finish_table = phases
+    data = prepare_table(cursor, model, table_data, primary_keys=False)
+    conn.commit()
+
+    key = data['pk'][0]
+    conditions = key_ranges(cursor, data['source'], key.name, key.type, count)
+    print(f"Loading table '{table_data['name']}' in {len(conditions)} ranges of '{key.name}'")
+    failed = []
+    with ProcessPoolExecutor(max_workers=len(conditions)) as pool:
+        futures = [pool.submit(load_range_job, model, table_data, data, load_table, where)
+                   for where in conditions]
+        for done, future in enumerate(as_completed(futures), 1):
+            where, elapsed, error = future.result()
+            if error is None:
+                print(f"[{done}/{len(futures)}] Range {where} loaded in {elapsed:.2f}s")
+            else:
+                failed.append(where)
+                print(f"[{done}/{len(futures)}] Range {where} failed after {elapsed:.2f}s: {error}")
+    if failed:
+        exit(f"Failed to load {len(failed)} range(s) of '{table_data['name']}'")
+
+    build_indexes_concurrently(model, index_table(cursor, model, table_data, data))
+    set_logged(cursor, model, data)
+    verify_checksums(cursor, model, table_data, data)
+    finish_table(cursor, model, table_data, data)
+    conn.commit()
+
+
+# table recording the completed steps of the checkpointed conversions: 'prepare' (with the pickled
+# description of the table), every chunk of 'load' (up to the key 'position', NULL for the last one),
+# 'index' and 'finish'
+journal_table = '''
+    CREATE TABLE IF NOT EXISTS mrv_journal (
+        table_name varchar,
+        step varchar,
+        chunk int DEFAULT 0,
+        position text,
+        rows bigint,
+        state bytea,
+        done_at timestamptz DEFAULT now(),
+        PRIMARY KEY (table_name, step, chunk)
+    )
+'''
+
+
+# converts a table committing every step, and every chunk of about 'chunkRows' rows of the
+# load, together with its record in the journal; with resume=True, the steps and chunks already
+# recorded are skipped, so a conversion that failed continues where it stopped
+def convert_table_checkpoint(conn, cursor, model, table_data, phases, resume=False):
+    prepare_table, load_table, index_table, finish_table = phases
+    table = table_data['name']
+    if not resume:
+        cursor.execute('DELETE FROM mrv_journal WHERE table_name = %s', (table,))
+    cursor.execute('SELECT step, chunk, position, rows, state FROM mrv_journal WHERE table_name = %s '
+                   'ORDER BY step, chunk', (table,))
+    journal = {}
+    for step, chunk, position, rows, state in cursor.fetchall():
+        journal.setdefault(step, []).append((chunk, position, rows, state))
+    if 'finish' in journal:
+        print(f"Table '{table}' was already converted")
+        return
+
+    def record(step, chunk=0, position=None, rows=None, state=None):
+        cursor.execute('INSERT INTO mrv_journal (table_name, step, chunk, position, rows, state) '
+                       'VALUES (%s, %s, %s, %s, %s, %s)', (table, step, chunk, position, rows, state))
+        conn.commit()
+
+    if 'prepare' in journal:
+        data = pickle.loads(journal['prepare'][0][3])
+        print(f"Resuming table '{table}'")
+    else:
+        data = prepare_table(cursor, model, table_data, primary_keys=False)
+        record('prepare', state=pickle.dumps(data))
+
+    chunks = journal.get('load', [])
+    if not chunks or chunks[-1][1] is not None:
+        done = sum(rows for _, _, rows, _ in chunks)
+        progress = Progress(table, done + count_rows(cursor, data['source'],
+                                                     f"{data['pk'][0].name} >= {chunks[-1][1]}" if chunks else 'TRUE'),
+                            done)
+        low = chunks[-1][1] if chunks else None
+        for chunk, (where, high) in enumerate(key_chunks(cursor, data['source'], data['pk'][0].name,
+                                                         model['chunkRows'], low), len(chunks)):
+            rows = count_rows(cursor, data['source'], where)
+            load_table(conn, cursor, model, table_data, data, where)
+            record('load', chunk, high, rows)
+            progress.update(rows)
+
+    if 'index' not in journal:
+        build_indexes(cursor, model, index_table(cursor, model, table_data, data))
+        verify_checksums(cursor, model, table_data, data)
+        record('index')
+    finish_table(cursor, model, table_data, data)
+    record('finish')
+
+
+# cursor that writes the statements to a SQL script instead of running them
+class ScriptCursor:
+    def __init__(self, file):
+        self.file = file
+        self.rowcount = -1
+
+    def mogrify(self, query, params=None):
+        if params is None:
+            return query
+        values = []
+        for param in params:
+            value = psycopg2.extensions.adapt(param)
+            if hasattr(value, 'encoding'):
+                value.encoding = 'utf8'
+            values.append(value.getquoted().decode())
+        return query % tuple(values)
+
+    def execute(self, query, params=None):
+        statement = self.mogrify(query, params).strip().rstrip(";")
+        self.file.write(statement + ';\n\n')
+
+    def commit(self):
+        pass
+
+
+# writes the conversion of every table of the model to a SQL script, in a single transaction,
+# instead of running it: the nodes are generated by the database ('sql' node generation), the
+# checksums are not verified and the script only depends on the model and the described tables
+def emit_script(model, phases, helpers, path):
+    model = dict(model, nodeGeneration='sql', verifyChecksums=False)
+    with open(path, 'w') as f:
+        f.write(f"-- Conversion of the tables {', '.join(t['name'] for t in model['tables'])} "
+                f"of schema '{model['schema']}' into multi record values\n\n")
+        script = ScriptCursor(f)
+        script.execute('BEGIN')
+        script.execute(f"SET search_path TO {model['schema']}")
+        for helper in helpers:
+            script.execute(helper_functions[helper])
+        for table_data in model['tables']:
+            convert_table(script, script, model, table_data, phases)
+        script.execute('COMMIT')
+    print(f"Wrote '{path}'")
+
+
+# loads the rows of a CSV file, whose header names (some of) the columns of the view, into an already
+# converted table: they are copied into an UNLOGGED staging table; the rows of keys the table already
+# has are written through the view (by the insert_<table> function of the structure, as an INSERT into
+# the view would), and the others are expanded into <table>_orig and the node tables by the load phase
+# of the converter, so they get the same nodes as the converted rows
+def ingest_table(conn, cursor, model, table_data, phases, path):
+    prepare_table, load_table, index_table, finish_table = phases
+    table = table_data['name']
+    stage = f'{table}__stage'
+    start = time.time()
+    cursor.execute(f'DROP TABLE IF EXISTS {stage}')
+    cursor.execute(f'CREATE UNLOGGED TABLE {stage} (LIKE {table})')
+
+    # the staged rows are described as the original table (the view has no primary key, so it is
+    # taken from <table>_orig) and the data of the conversion is rebuilt without running its statements
+    described = describe_tables(cursor, model['schema'], [stage, f'{table}_orig'])
+    catalog[table] = Table(table, described[stage].attributes, described[f'{table}_orig'].primary_key, [])
+    with open(path, newline='') as f:
+        header = next(csv.reader([f.readline()]))
+        view_columns = [column.name for column in catalog[table].columns()]
+        unknown = [column for column in header if column not in view_columns]
+        if unknown:
+            exit(f"Columns {', '.join(unknown)} of '{path}' are not columns of '{table}'")
+        columns = ', '.join(quote_ident(column, cursor) for column in header)
+        cursor.copy_expert(f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv)", f)
+    count = cursor.rowcount
+
+    data = prepare_table(ScriptCursor(io.StringIO()), model, table_data, online=True)
+    data['source'] = stage
+    existing = f'''EXISTS (SELECT 1 FROM {table}_orig AS O
+                   WHERE {' AND '.join(f'O.{column.name} = S.{column.name}' for column in data['pk'])})'''
+    cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {stage} AS S WHERE {existing}')
+    cursor.execute(f'DELETE FROM {stage} AS S WHERE {existing}')
+    if data['rename'] == f'{table}_orig':
+        # the original table itself was kept as <table>_orig (serial), so it is not loaded by load_table
+        not_mrv = ', '.join(column.name for column in data['not_mrv'])
+        cursor.execute(f'INSERT INTO {table}_orig ({not_mrv}) SELECT {not_mrv} FROM {stage}')
+    load_table(conn, cursor, model, table_data, data)
+    cursor.execute(f'DROP TABLE {stage}')
+    print(f"Ingested {count} rows into '{table}' in {time.time() - start:.2f}s")
+
+
+# number of times the online conversion tries to lock a table before giving up
+swap_attempts = 10
+
+
+# converts a table while it stays writable: the new tables are created next to it and every change
+# to its rows is recorded by a trigger in a change log; the rows are then copied in chunks of about
+# 'chunkRows' rows, each in its own transaction (pausing 'onlineChunkPause' seconds between
+# them), and the logged keys are copied again until the log is almost empty; finally, the table is
+# locked, the last changes are replayed and it is replaced by the view in a single short transaction
+def convert_table_online(conn, cursor, model, table_data, phases):
+    prepare_table, load_table, index_table, finish_table = phases
+    table = table_data['name']
+    data = prepare_table(cursor, model, table_data, primary_keys=False, online=True)
+    create_change_log(cursor, table, data)
+    conn.commit()
+
+    progress = Progress(table, count_rows(cursor, table))
+    for where, high in key_chunks(cursor, table, data['pk'][0].name, model['chunkRows']):
+        rows = count_rows(cursor, table, where)
+        load_table(conn, cursor, model, table_data, data, where)
+        conn.commit()
+        progress.update(rows)
+        if high is not None:
+            time.sleep(model['onlineChunkPause'])
+
+    build_indexes_concurrently(model, index_table(cursor, model, table_data, data))
+    conn.commit()
+    while replay_changes(conn, cursor, model, table_data, data, load_table) >= model['chunkRows']:
+        conn.commit()
+        time.sleep(model['onlineChunkPause'])
+    set_logged(cursor, model, data)
+    conn.commit()
+
+    # swap: no change can be missed once the table is locked
+    for attempt in range(1, swap_attempts + 1):
+        cursor.execute(f"SET LOCAL lock_timeout = '{model['onlineLockTimeout']}'")
+        try:
+            cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+            break
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            print(f"Could not lock '{table}' (attempt {attempt}/{swap_attempts})")
+            replay_changes(conn, cursor, model, table_data, data, load_table)
+            conn.commit()
+    else:
+        exit(f"Failed to lock '{table}': its changes are still recorded in '{table}__log'")
+    while replay_changes(conn, cursor, model, table_data, data, load_table) > 0:
+        pass
+    verify_checksums(cursor, model, table_data, data)
+    cursor.execute(f'DROP TRIGGER {table}__log ON {table}')
+    cursor.execute(f'DROP FUNCTION {table}__log()')
+    cursor.execute(f'DROP TABLE {table}__log')
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {data['rename']}")
+    data['source'] = data['rename']
+    finish_table(cursor, model, table_data, data)
+    conn.commit()
+
+
+# records the keys of the rows inserted, updated or deleted in a table into '{table}__log'
+def create_change_log(cursor, table, data):
+    keys = ', '.join(pk.name for pk in data['pk'])
+    cursor.execute(f'''
+        CREATE TABLE {table}__log (
+            log__id bigserial PRIMARY KEY,
+            {', '.join(f'{pk.name} {pk.type}' for pk in data['pk'])}
+        )''')
+    cursor.execute(f'''
+        CREATE FUNCTION {table}__log() RETURNS trigger
+        AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                INSERT INTO {table}__log ({keys}) VALUES ({', '.join(f'OLD.{pk.name}' for pk in data['pk'])});
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {table}__log ({keys}) VALUES ({', '.join(f'NEW.{pk.name}' for pk in data['pk'])});
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER {table}__log
+        AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE PROCEDURE {table}__log()
+    ''')
+
+
+# splits the rows of a table into chunks of about 'rows' rows (more if many rows share a value)
+# of consecutive values of a column, starting at the literal 'low', if given: yields the condition
+# selecting each chunk and the literal of its upper bound (None for the last chunk)
+def key_chunks(cursor, table, column, rows, low=None):
+    while True:
+        if low is None:
+            cursor.execute(f'SELECT {column} FROM {table} ORDER BY {column} OFFSET %s LIMIT 1', (rows,))
+        else:
+            cursor.execute(f'SELECT {column} FROM {table} WHERE {column} > {low} ORDER BY {column} '
+                           f'OFFSET %s LIMIT 1', (rows - 1,))
+        row = cursor.fetchone()
+        high = cursor.mogrify('%s', (row[0],)).decode() if row is not None else None
+        conditions = ([] if low is None else [f'{column} >= {low}']) + \
+                     ([] if high is None else [f'{column} < {high}'])
+        yield ' AND '.join(conditions) or 'TRUE', high
+        if high is None:
+            return
+        low = high
+
+
+def count_rows(cursor, table, where='TRUE'):
+    cursor.execute(f'SELECT count(*) FROM {table} WHERE {where}')
+    return cursor.fetchone()[0]
+
+
+# reports the rows copied from a table so far, their rate and the estimated time left
+class Progress:
+    def __init__(self, table, total, done=0):
+        self.table = table
+        self.total = total
+        self.done = done
+        self.start_done = done
+        self.start = time.time()
+
+    def update(self, rows):
+        self.done += rows
+        elapsed = max(time.time() - self.start, 1e-6)
+        rate = (self.done - self.start_done) / elapsed
+        left = (self.total - self.done) / rate if rate > 0 else 0
+        print(f"'{self.table}': {self.done}/{self.total} rows ({100 * self.done / max(self.total, 1):.1f}%), "
+              f"{rate:.0f} rows/s, ETA {datetime.timedelta(seconds=round(max(left, 0)))}")
+
+
+# takes up to 'chunkRows' changes from the log of a table and copies the changed keys again:
+# their rows are removed from the new tables and loaded from the table; returns the number of
+# changes taken
+def replay_changes(conn, cursor, model, table_data, data, load_table):
+    table = table_data['name']
+    keys = ', '.join(pk.name for pk in data['pk'])
+    cursor.execute(f'''
+        CREATE TEMPORARY TABLE IF NOT EXISTS {table}__keys (
+            {', '.join(f'{pk.name} {pk.type}' for pk in data['pk'])}
+        ) ON COMMIT DELETE ROWS
+    ''')
+    cursor.execute(f'''
+        WITH changes AS (
+            DELETE FROM {table}__log
+            WHERE log__id IN (SELECT log__id FROM {table}__log ORDER BY log__id LIMIT %s)
+            RETURNING {keys}
+        )
+        INSERT INTO {table}__keys
+        SELECT {keys} FROM changes
+    ''', (model['chunkRows'],))
+    count = cursor.rowcount
+    if count > 0:
+        where = f'({keys}) IN (SELECT {keys} FROM {table}__keys)'
+        for shadow in data['shadows']:
+            cursor.execute(f'DELETE FROM {shadow} WHERE {where}')
+        load_table(conn, cursor, model, table_data, data, where)
+        cursor.execute(f'TRUNCATE {table}__keys')
+    return count
+
+
+# splits the values of a column into at most 'count' ranges with about the same number of rows,
+# returned as SQL conditions; the bounds come from the histogram of the planner statistics
+# (sampled by ANALYZE) or, if the column has none, from its exact quantiles
+def key_ranges(cursor, table, column, type, count):
+    cursor.execute(f'ANALYZE {table}')
+    cursor.execute(f'''
+        SELECT histogram_bounds::text::{type}[]
+        FROM pg_stats
+        WHERE schemaname = current_schema() AND tablename = %s AND attname = %s
+    ''', (table, column))
+    row = cursor.fetchone()
+    bounds = row[0] if row is not None and row[0] is not None else None
+    if bounds is not None:
+        bounds = [bounds[round(i * (len(bounds) - 1) / count)] for i in range(1, count)]
+    else:
+        cursor.execute(f'''
+            SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY {column})
+            FROM {table}
+        ''', ([i / count for i in range(1, count)],))
+        bounds = [x for x in cursor.fetchone()[0] or [] if x is not None]
+    bounds = sorted(set(bounds))
+
+    if not bounds:
+        return ['TRUE']
+    conditions = [cursor.mogrify(f'{column} < %s', (bounds[0],)).decode()]
+    for low, high in zip(bounds, bounds[1:]):
+        conditions.append(cursor.mogrify(f'{column} >= %s AND {column} < %s', (low, high)).decode())
+    conditions.append(cursor.mogrify(f'{column} >= %s', (bounds[-1],)).decode())
+    return conditions
+
+
+# streams the result of a query in batches of at most 'fetch_size' rows,
+# using a server-side (named) cursor so the whole result is never held in memory
+def stream_batches(conn, name, query, fetch_size):
+    cursor = conn.cursor(name=name)
+    cursor.itersize = fetch_size
+    cursor.execute(query)
+    while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+            break
+        yield batch
+    cursor.close()
+
+
+rng = np.random.default_rng()
+
+# maximum number of random sort keys drawn at once by sample_rks
+sample_chunk_cells = 1 << 22
+
+
+# draws 'count' distinct rks in [0, max_nodes) for each of 'size' keys at once, as a
+# (size, count) array: every key gets a row of random sort keys and its rks are the
+# positions of the 'count' smallest ones, in random order
+def sample_rks(size, max_nodes, count):
+    chunk = max(sample_chunk_cells // max_nodes, 1)
+    samples = []
+    for start in range(0, size, chunk):
+        keys = rng.random((min(chunk, size - start), max_nodes), dtype=np.float32)
+        if count < max_nodes:
+            rks = np.argpartition(keys, count - 1, axis=1)[:, :count] if count > 0 \
+                else np.empty((keys.shape[0], 0), dtype=np.int64)
+            order = np.argsort(np.take_along_axis(keys, rks, axis=1), axis=1)
+            samples.append(np.take_along_axis(rks, order, axis=1))
+        else:
+            samples.append(np.argsort(keys, axis=1))
+    if not samples:
+        return np.empty((0, count), dtype=np.int64)
+    return np.concatenate(samples)
+
+
+# rks of the 'count' initial nodes of 'size' keys: distinct random rks in [0, maxNodes) or, with the
+# 'dense' rkLayout, the rks 0..count-1
+def node_rks(size, model, count):
+    if model['rkLayout'] == 'dense':
+        return np.tile(np.arange(count), (size, 1))
+    return sample_rks(size, model['maxNodes'], count)
+
+
+# rk of the i-th node a write function creates for a new key (given by the '<key>_new' parameters);
+# the sparse rks are drawn among the ones its nodes in mrv_table do not have yet
+def insert_rk(model, i, mrv_table, keys):
+    if model['rkLayout'] == 'dense':
+        return str(i)
+    return f"""(SELECT r FROM generate_series(0, {model['maxNodes']}) AS r
+                         WHERE NOT EXISTS (SELECT 1 FROM {mrv_table} WHERE {' AND '.join(f'{key} = {key}_new' for key in keys)} AND rk = r)
+                         ORDER BY RANDOM() LIMIT 1)"""
+
+
+# set of rks in [0, max_nodes) already taken by the nodes of one key, kept as a bitmap
+class RkBitmap:
+    def __init__(self, max_nodes):
+        self.max_nodes = max_nodes
+        self.bits = bytearray((max_nodes + 7) // 8)
+        self.count = 0
+
+    def __contains__(self, rk):
+        return self.bits[rk >> 3] & (1 << (rk & 7)) != 0
+
+    def reset(self):
+        self.bits[:] = bytes(len(self.bits))
+        self.count = 0
+
+    # takes a random free rk: rejection sampling while at most half of the rks are taken,
+    # a scan of the free ones otherwise
+    def take(self):
+        if self.count >= self.max_nodes:
+            exit(f'A key needs more than {self.max_nodes} nodes (maxNodes)')
+        if self.count * 2 <= self.max_nodes:
+            rk = random.randrange(self.max_nodes)
+            while rk in self:
+                rk = random.randrange(self.max_nodes)
+        else:
+            rk = random.choice([x for x in range(self.max_nodes) if x not in self])
+        self.bits[rk >> 3] |= 1 << (rk & 7)
+        self.count += 1
+        return rk
+
+
+# inserts the rows produced by an iterable in batches of at most 'batch_size' rows
+def insert_rows(cursor, table, rows, batch_size):
+    count = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            execute_values(cursor, f'INSERT INTO {table} VALUES %s', batch, page_size=batch_size)
+            count += len(batch)
+            batch = []
+    if batch:
+        execute_values(cursor, f'INSERT INTO {table} VALUES %s', batch, page_size=batch_size)
+        count += len(batch)
+    return count
+
+
+# loads the rows produced by an iterable into a table with the loader selected in the model
+# ('copy' or 'insert') and reports the throughput
+def load_rows(cursor, table, rows, model):
+    start = time.time()
+    if model['loader'] == 'copy':
+        # the rows may come from a server-side cursor on the same connection, which cannot
+        # be read while a COPY is in progress, so every COPY gets a bounded chunk of rows
+        count = 0
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, model['insertBatchSize']))
+            if not chunk:
+                break
+            count += copy_rows(cursor, table, chunk, model['copyFormat'])
+    else:
+        count = insert_rows(cursor, table, rows, model['insertBatchSize'])
+    report_load(table, count, start)
+    return count
+
+
+# loads the rows of a query into a table without them leaving the database
+def load_query(cursor, table, query):
+    start = time.time()
+    cursor.execute(f'INSERT INTO {table} {query}')
+    if cursor.rowcount >= 0:
+        report_load(table, cursor.rowcount, start)
+    return cursor.rowcount
+
+
+def report_load(table, count, start):
+    elapsed = max(time.time() - start, 1e-6)
+    print(f"Loaded {count} rows into '{table}' in {elapsed:.2f}s ({count / elapsed:.0f} rows/s)")
+
+
+# LATERAL subquery (N) that draws 'count' distinct random rks in [0, max_nodes) for each
+# row of the outer query, numbered by N.i from 1; 'correlation' is a condition on the
+# outer row that forces the subquery to be evaluated again for every row
+def random_rks_sql(max_nodes, count, correlation):
+    return f'''CROSS JOIN LATERAL (
+                SELECT rk, ROW_NUMBER() OVER () AS i
+                FROM (
+                    SELECT rk
+                    FROM generate_series(0, {max_nodes - 1}) AS rk
+                    WHERE {correlation}
+                    ORDER BY RANDOM()
+                    LIMIT {count}
+                ) AS R
+            ) AS N'''
+
+
+# like random_rks_sql, but following the rkLayout of the model
+def node_rks_sql(model, count, correlation):
+    if model['rkLayout'] == 'dense':
+        return f'''CROSS JOIN LATERAL (
+                SELECT rk, rk + 1 AS i
+                FROM generate_series(0, {count - 1}) AS rk
+                WHERE {correlation}
+            ) AS N'''
+    return random_rks_sql(model['maxNodes'], count, correlation)
+
+
+# COPY
+
+# file-like object that encodes the rows of an iterable on demand, so COPY can
+# consume them without the whole input being materialized
+class CopyStream:
+    def __init__(self, rows, encode_row, header=b'', trailer=b''):
+        self.rows = iter(rows)
+        self.encode_row = encode_row
+        self.buffer = bytearray(header)
+        self.trailer = trailer
+        self.count = 0
+        self.done = False
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            row = next(self.rows, None)
+            if row is None:
+                self.buffer += self.trailer
+                self.done = True
+            else:
+                self.buffer += self.encode_row(row)
+                self.count += 1
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+# streams the rows of an iterable into a table with COPY ... FROM STDIN
+def copy_rows(cursor, table, rows, copy_format='text'):
+    if copy_format == 'text':
+        stream = CopyStream(rows, encode_text_row)
+    else:
+        encoders = [binary_encoder(type, elem_type, elem_oid)
+                    for type, elem_type, elem_oid in table_types(cursor, table)]
+        stream = CopyStream(rows, lambda row: encode_binary_row(row, encoders),
+                            header=b'PGCOPY\n\377\r\n\0' + struct.pack('!ii', 0, 0),
+                            trailer=struct.pack('!h', -1))
+    cursor.copy_expert(f'COPY {table} FROM STDIN WITH (FORMAT {copy_format})', stream)
+    return stream.count
+
+
+# type name, element type name and element type oid of each column of a table
+def table_types(cursor, table):
+    cursor.execute('''
+        SELECT t.typname, e.typname, t.typelem
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        LEFT JOIN pg_type e ON e.oid = t.typelem AND t.typcategory = 'A'
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum
+    ''', (table,))
+    return cursor.fetchall()
+
+
+text_escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def text_value(value):
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        return text_array(value)
+    return str(value)
+
+
+def text_array(values):
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            items.append(text_array(value))
+        else:
+            value = text_value(value).replace('\\', '\\\\').replace('"', '\\"')
+            items.append(f'"{value}"')
+    return '{' + ','.join(items) + '}'
+
+
+def encode_text_row(row):
+    return ('\t'.join('\\N' if value is None else text_value(value).translate(text_escapes)
+                      for value in row) + '\n').encode()
+
+
+# binary format encoders (value -> bytes), by type name
+def encode_numeric(value):
+    value = Decimal(value)
+    if value.is_nan():
+        return struct.pack('!hhHh', 0, 0, 0xC000, 0)
+    sign, digits, exponent = value.as_tuple()
+    dscale = max(-exponent, 0)
+    # split the digits in base 10000 groups aligned on the decimal point
+    point = max(len(digits) + exponent, 0)
+    integer = ''.join(map(str, digits[:point])) if exponent < 0 else \
+        ''.join(map(str, digits)) + '0' * exponent
+    fraction = ''.join(map(str, digits[point:])).rjust(-exponent, '0') if exponent < 0 else ''
+    integer = integer.lstrip('0')
+    integer = integer.rjust((len(integer) + 3) // 4 * 4, '0')
+    fraction = fraction.ljust((len(fraction) + 3) // 4 * 4, '0')
+    groups = [int(integer[i:i + 4]) for i in range(0, len(integer), 4)] + \
+             [int(fraction[i:i + 4]) for i in range(0, len(fraction), 4)]
+    weight = len(integer) // 4 - 1
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    return struct.pack(f'!hhHh{len(groups)}H', len(groups), weight, 0x4000 if sign else 0, dscale, *groups)
+
+
+pg_epoch = datetime.datetime(2000, 1, 1)
+
+binary_encoders = {
+    'bool': lambda v: struct.pack('!?', v),
+    'int2': lambda v: struct.pack('!h', v),
+    'int4': lambda v: struct.pack('!i', v),
+    'int8': lambda v: struct.pack('!q', v),
+    'float4': lambda v: struct.pack('!f', v),
+    'float8': lambda v: struct.pack('!d', v),
+    'numeric': encode_numeric,
+    'text': lambda v: str(v).encode(),
+    'varchar': lambda v: str(v).encode(),
+    'bpchar': lambda v: str(v).encode(),
+    'date': lambda v: struct.pack('!i', (v - pg_epoch.date()).days),
+    'timestamp': lambda v: struct.pack('!q', (v - pg_epoch) // datetime.timedelta(microseconds=1)),
+}
+
+
+def binary_encoder(type, elem_type=None, elem_oid=None):
+    if elem_type is not None and elem_type in binary_encoders:
+        encode_elem = binary_encoders[elem_type]
+        return lambda values: encode_binary_array(values, encode_elem, elem_oid)
+    if type not in binary_encoders:
+        exit(f"Binary COPY does not support the type '{type}' (use copyFormat: text)")
+    return binary_encoders[type]
+
+
+# one-dimensional arrays only, as used by the MRV node tables
+def encode_binary_array(values, encode_elem, elem_oid):
+    if not values:
+        return struct.pack('!iiI', 0, 0, elem_oid)
+    has_null = any(value is None for value in values)
+    data = bytearray(struct.pack('!iiIii', 1, int(has_null), elem_oid, len(values), 1))
+    for value in values:
+        if value is None:
+            data += struct.pack('!i', -1)
+        else:
+            encoded = encode_elem(value)
+            data += struct.pack('!i', len(encoded)) + encoded
+    return bytes(data)
+
+
+def encode_binary_row(row, encoders):
+    data = bytearray(struct.pack('!h', len(row)))
+    for value, encode in zip(row, encoders):
+        if value is None:
+            data += struct.pack('!i', -1)
+        else:
+            encoded = encode(value)
+            data += struct.pack('!i', len(encoded)) + encoded
+    return bytes(data)
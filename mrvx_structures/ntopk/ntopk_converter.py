@@ -1,30 +1,16 @@
 # Converts the columns provided in the model file into multi record values (PostgreSQL only)
-# Usage: python3 convert_model.py <model-yml> [<initial-nodes>]
+# Usage: python3 convert_model.py <model-yml> [<initial-nodes>] [--jobs N] [--ranges N] [--online] [--checkpoint] [--resume]
+#        [--catalog FILE] [--emit-sql FILE] [--ingest TABLE FILE]
 
-import psycopg2
-from psycopg2.extras import execute_values
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import yaml
 import sys
 from collections import defaultdict
 import random
 import re
+import os
 
-
-type_translation = {
-    'character': 'varchar',
-    'smallint': 'integer'
-}
-
-# column in a relation
-class Column:
-    def __init__(self, name, type, nullable):
-        self.name = name
-        self.type = type_translation.get(type, type)
-        self.nullable = True if nullable == 'YES' else False
-
-    def __repr__(self):
-        return f'name: {self.name}, type: {self.type}, nullable: {self.nullable}'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from converter_utils import parse_args, load_model, convert_model, describe_table, write_path, lookup_functions, RkBitmap, stream_batches, load_rows
 
 
 def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='', with_cast=False):
@@ -35,25 +21,39 @@ def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='
         return join.join([name_prefix + x.name + name_suffix + '::' + x.type for x in data])
 
 
-if len(sys.argv) < 2:
-    exit('Usage: python3 convert_model.py <model-yml> [<initial-nodes>]')
+# generates one node per (pk, payloads, value) row, with the rows ordered by key: only
+# the rks taken by the current key are kept and its padding (empty nodes up to
+# max(initialNodes, k)) is generated as soon as the key changes
+def generate_nodes(batches, model, num_payload, k):
+    regs = max(model['initialNodes'], k)
+    payloads = (None,) * num_payload
+    rks = RkBitmap(model['maxNodes'])
+    current_pk = None
+    for batch in batches:
+        for row in batch:
+            value = row[-1]
+            pk = row[:-num_payload-1]
+            if pk != current_pk:
+                if current_pk is not None:
+                    while rks.count < regs:
+                        yield current_pk + (rks.take(),) + payloads + (0,)
+                rks.reset()
+                current_pk = pk
 
+            yield pk + (rks.take(),) + row[-num_payload-1:-1] + (value,)
 
-model_file = sys.argv[1]
-with open(model_file) as f:
-    model = yaml.load(f, Loader=yaml.FullLoader)
+    if current_pk is not None:
+        while rks.count < regs:
+            yield current_pk + (rks.take(),) + payloads + (0,)
 
-if len(sys.argv) >= 3:
-    model['initialNodes'] = min(int(sys.argv[2]), model['maxNodes'])
 
-conn = psycopg2.connect(dbname=model['database'], host=model['host'], port=model['port'],
-                        user=model['user'], password=model['password'])
-cursor = conn.cursor()
-cursor.execute(f"SET search_path TO {model['schema']}")
+k = 5
 
 
-k = 5
-for table_data in model['tables']:
+# describes a table of the model, renames it and creates its new tables; with primary_keys=False
+# the primary keys are only created by index_table, after the data is loaded, and with online=True
+# the table keeps its name (and stays writable) until it is replaced by the view
+def prepare_table(cursor, model, table_data, primary_keys=True, online=False):
     data = {}
     table = table_data['name']
     print(f"Processing table '{table}'")
@@ -64,26 +64,10 @@ for table_data in model['tables']:
     else:
         order = []
     
-    # all columns
-    cursor.execute(f'''
-        SELECT column_name, udt_name, is_nullable
-        FROM information_schema.columns
-        WHERE table_schema = '{model['schema']}'
-        AND table_name = '{table}';
-    ''')
-    all_columns = [Column(x[0], x[1], x[2]) for x in cursor.fetchall()]
-
-
-    # primary keys
-    cursor.execute(f'''
-        SELECT a.attname
-        FROM   pg_index i
-        JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                            AND a.attnum = ANY(i.indkey)
-        WHERE  i.indrelid = '{table}'::regclass
-        AND    i.indisprimary;
-    ''')
-    primary_keys_names = set([x[0] for x in cursor.fetchall()])
+    # all columns and primary keys, from the catalog
+    description = describe_table(cursor, model, table)
+    all_columns = description.columns(udt_names=True)
+    primary_keys_names = set(description.primary_key)
 
     # store primary, regular and mrv columns for future uses
     data['pk'] = [x for x in all_columns if x.name in primary_keys_names and x.name not in order]
@@ -96,93 +80,134 @@ for table_data in model['tables']:
         data['order'] = [x for x in all_columns if x.name in order]
     data['not_mrv'] = [x for x in all_columns if x.name not in mvn_names and x.name not in payload_names and x.name not in order]
     data['all'] = all_columns
-    
+    data['indexes'] = description.indexes
+    data['rename'] = f'{table}__aux'
+    data['source'] = table if online else data['rename']
+    data['deferred_keys'] = not primary_keys
+    # the new tables are only made logged once they are loaded and indexed
+    unlogged = 'UNLOGGED ' if model['unloggedLoad'] else ''
+
 
     # rename table
-    cursor.execute(f'''
-        ALTER TABLE {table}
-        RENAME TO {table}__aux
-    ''')
+    if not online:
+        cursor.execute(f'''
+            ALTER TABLE {table}
+            RENAME TO {data['rename']}
+        ''')
 
     # create main table
     cursor.execute(f'''
-        CREATE TABLE {table}_orig (
-            {columns_str(data['not_mrv'], with_types=True)},
-            PRIMARY KEY({columns_str(data['pk'])})
+        CREATE {unlogged}TABLE {table}_orig (
+            {columns_str(data['not_mrv'], with_types=True)}''' + (f''',
+            PRIMARY KEY({columns_str(data['pk'])})''' if primary_keys else '') + '''
         )''')
 
+
+#MAX STRUCTURE
+#rk, id, value pk(rk,id,value)
+
+    # create mrv tables
+    payload_types = [f'{payload.name} {payload.type}' for payload in data['payload']]
+    for mrv in data['mrv']:
+        # create table
+        cursor.execute(f'''
+            CREATE {unlogged}TABLE {table}_{mrv.name} (
+                {columns_str(data['pk'], with_types=True)},
+                rk int,
+                {', '.join(payload_types)}, {mrv.name} {mrv.type}''' + (f''',
+                PRIMARY KEY ({columns_str(data['pk'])}, rk)''' if primary_keys else '') + '''
+            )''')
+
+    data['shadows'] = [f'{table}_orig'] + [f'{table}_{mrv.name}' for mrv in data['mrv']]
+    return data
+
+
+# copies the rows of the original table that match 'where' to the new tables
+def load_table(conn, cursor, model, table_data, data, where='TRUE'):
+    table = table_data['name']
+
     # copy data to main table
     cursor.execute(f'''
         INSERT INTO {table}_orig (
             SELECT DISTINCT {columns_str(data['not_mrv'])}
-            FROM {table}__aux
+            FROM {data['source']}
+            WHERE {where}
         )''')
 
+    num_payload = len(data['payload'])
+    payloads = [f'{payload.name}' for payload in data['payload']]
+    for mrv in data['mrv']:
+        # move data
+        batches = stream_batches(conn, f'{table}_{mrv.name}_stream',
+                                 f"""SELECT {columns_str(data['pk'])}, {', '.join(payloads)}, {mrv.name} FROM {data['source']}
+                                     WHERE {where}
+                                     ORDER BY {columns_str(data['pk'])}""",
+                                 model['fetchSize'])
+        load_rows(cursor, f'{table}_{mrv.name}', generate_nodes(batches, model, num_payload, k), model)
+
+
+# the definition of an index (from pg_get_indexdef) without the given columns in its key, or None
+# when it has no other column
+def without_columns(index, names):
+    start = re.search(r'USING \w+ \(', index).end()
+    columns = []
+    depth, column_start, end = 1, start, start
+    while depth > 0:
+        if index[end] == '(':
+            depth += 1
+        elif index[end] == ')':
+            depth -= 1
+        if depth == 0 or (depth == 1 and index[end] == ','):
+            columns.append(index[column_start:end].strip())
+            column_start = end + 1
+        end += 1
+    kept = [column for column in columns if column.split()[0].strip('"') not in names]
+    if not kept:
+        return None
+    return index[:start] + ', '.join(kept) + index[end - 1:]
+
+
+# returns the statements that create the deferred primary keys and the indexes of the original
+# table, one list per table
+def index_table(cursor, model, table_data, data):
+    table = table_data['name']
+    statements = {f'{table}_orig': []}
+    statements.update({f'{table}_{mrv.name}': [] for mrv in data['mrv']})
+
+    if data['deferred_keys']:
+        statements[f'{table}_orig'].append(f"ALTER TABLE {table}_orig ADD PRIMARY KEY ({columns_str(data['pk'])})")
+        for mrv in data['mrv']:
+            statements[f'{table}_{mrv.name}'].append(f"ALTER TABLE {table}_{mrv.name} ADD PRIMARY KEY ({columns_str(data['pk'])}, rk)")
+
+    # the (pk, value) index of the nodes, used by the writes to find the k-th best value of a key
+    # and the node it replaces
+    for mrv in data['mrv']:
+        statements[f'{table}_{mrv.name}'].append(
+            f"CREATE INDEX IF NOT EXISTS {table}_{mrv.name}_value_idx ON {table}_{mrv.name} ({columns_str(data['pk'])}, {mrv.name})")
+
     # recreate indexes
-    cursor.execute(f'''
-        SELECT indexdef
-        FROM pg_indexes
-        WHERE schemaname = 'public' AND tablename = '{table}__aux'
-    ''')
 
     if k > 1:
         orders = [f'{order.name}' for order in data['order']]
-    for index, in cursor.fetchall():
+    for index in data['indexes']:
         index = re.sub(f"{table}", f"{table}_orig", index)
         index = re.sub(f"{table}_orig__aux", f"{table}_orig", index)
         if k > 1:
-            index = re.sub(f"{', '.join(orders)}", "", index)
+            index = without_columns(index, orders)
+            if index is None:
+                continue
         index = re.sub(r'CREATE\s*(UNIQUE)?\s*INDEX', r'CREATE \1 INDEX IF NOT EXISTS', index)
-        cursor.execute(index)
+        statements[f'{table}_orig'].append(index)
 
+    return list(statements.values())
 
-#MAX STRUCTURE
-#rk, id, value pk(rk,id,value)
-
-    # create mrv tables
-    num_payload = len(data['payload'])
-    payload_types = [f'{payload.name} {payload.type}' for payload in data['payload']]
-    payloads = [f'{payload.name}' for payload in data['payload']]
-    for mrv in data['mrv']:
-        # create table
-        cursor.execute(f'''
-            CREATE TABLE {table}_{mrv.name} (
-                {columns_str(data['pk'], with_types=True)},
-                rk int,
-                {', '.join(payload_types)}, {mrv.name} {mrv.type},
-                PRIMARY KEY ({columns_str(data['pk'])}, rk)
-            )''')
-        # move data
-        cursor.execute(f"SELECT {columns_str(data['pk'])}, {', '.join(payloads)}, {mrv.name} FROM {table}__aux")
-        inserts_rows = []
-        initial_nodes = model['initialNodes']
-        seen_pk = dict()
-        for row in cursor:
-            value = row[-1]
-            payloads = row[-num_payload-1:-1]
-            pk = row[:-num_payload-1]
-            if pk not in seen_pk:
-                seen_pk[pk] = [x for x in range(model['maxNodes'])]
-
-            rk = seen_pk[pk][random.randrange(len(seen_pk[pk]))]
-            seen_pk[pk].remove(rk)
-            insert_row = pk + (rk,) + payloads + (value,)
-            inserts_rows.append(insert_row)
-        
-        regs = max(initial_nodes,k)
-        payloads = ()
-        for _ in payload_names:
-            payloads += (None, ) 
-        for key, value in seen_pk.items():
-            size = len(value)
-            while model['maxNodes'] - size < regs:
-                rk = value[random.randrange(size)]
-                value.remove(rk)
-                size -= 1
-                insert_row = key + (rk,) + payloads + (0,)
-                inserts_rows.append(insert_row)
-        execute_values(cursor, f"INSERT INTO {table}_{mrv.name} VALUES %s", inserts_rows)
 
+# replaces the original table with the view and creates its functions and write path
+def finish_table(cursor, model, table_data, data):
+    table = table_data['name']
+    initial_nodes = model['initialNodes']
+    # the view and functions below are built for the last mrv column
+    mrv = data['mrv'][-1]
 
     # remove aux table
     cursor.execute(f'DROP TABLE {table}__aux')
@@ -217,81 +242,114 @@ for table_data in model['tables']:
             ON {' AND '.join([f'A.{pk.name} = B.{pk.name}' for pk in data['pk']])} AND A.{mrv.name} = B.{mrv.name};
         ''')
 
+    # point lookups of the view, reading only the nodes of the given keys (the k best of each key,
+    # instead of numbering the nodes of every key)
+    def rows(match):
+        nodes = ' AND '.join([f'N.{pk.name} = OG.{pk.name}' for pk in data['pk']])
+        if k > 1:
+            return f'''
+                SELECT {columns_str(data['pk'], name_prefix='OG.')}, T.{orders_str}, T.{mrv.name}, {columns_str(data['payload'], name_prefix='T.')}
+                FROM {table}_orig AS OG
+                CROSS JOIN LATERAL (
+                    SELECT ROW_NUMBER() OVER (ORDER BY {mrv.name} DESC) AS {orders_str}, {mrv.name}, {payloads_str}
+                    FROM {table}_{mrv.name} AS N
+                    WHERE {nodes}
+                    ORDER BY {mrv.name} DESC
+                    LIMIT {k}
+                ) AS T
+                WHERE {match('OG')}
+                ORDER BY {columns_str(data['pk'], name_prefix='OG.', join=' ASC, ')} ASC, T.{orders_str} ASC'''
+        return f'''
+            SELECT OG.*, B.{mrv.name}, {columns_str(data['payload'], name_prefix='B.')}
+            FROM {table}_orig AS OG
+            CROSS JOIN LATERAL (
+                SELECT MAX({mrv.name}) AS {mrv.name} FROM {table}_{mrv.name} AS N
+                WHERE {nodes}
+            ) AS A
+            JOIN {table}_{mrv.name} AS B ON {' AND '.join([f'B.{pk.name} = OG.{pk.name}' for pk in data['pk']])} AND B.{mrv.name} = A.{mrv.name}
+            WHERE {match('OG')}'''
+
+    for statement in lookup_functions(table, f'{table}_ntopk', data['pk'], rows):
+        cursor.execute(statement)
+
     
     for mrv in data['mrv']:
         #Write MAX
         cursor.execute(f'''
             CREATE OR REPLACE FUNCTION topk_insert_{table}_{mrv.name}({columns_str(data['pk'], name_suffix='_', with_types=True)}, rk_ int, {', '.join([f'{payload.name}_ {payload.type}' for payload in data['payload']])}, {mrv.name}_ {mrv.type}) RETURNS void
             AS $$ 
-            DECLARE count int;
+            DECLARE threshold {mrv.type};
                     ins_rk int;
-                    cur_rk int;
-                    cur_{mrv.name} int;
-                    done bool = False;
-                    cursor_rk CURSOR FOR 
-                        (SELECT rk, {mrv.name} 
-                        FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk >= rk_ 
-                        ORDER BY rk) 
-                        UNION ALL 
-                        (SELECT rk, {mrv.name} 
-                        FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk < rk_ 
-                        ORDER BY rk);
 
             BEGIN 
-                count := 0;
-                
-                OPEN cursor_rk;
-                WHILE NOT done AND count < {k}
-                LOOP
-                    FETCH cursor_rk INTO cur_rk, cur_{mrv.name}; 
-                    IF NOT FOUND THEN 
-                        done := TRUE; 
-                    ELSEIF cur_{mrv.name} >= {mrv.name}_ THEN
-                        count := count + 1;
-                    END IF;
-                END LOOP;
-                CLOSE cursor_rk; 
-
-                IF count < {k} THEN
-                    SELECT rk INTO ins_rk FROM (
-                        SELECT rk, {mrv.name} FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} 
-                        ORDER BY {mrv.name} DESC 
-                        OFFSET {k-1} ROWS) AS T
-                    ORDER BY RANDOM()
-                    LIMIT 1;
-                
-                    UPDATE {table}_{mrv.name} 
-                    SET {mrv.name} = {mrv.name}_, {', '.join([f'{payload.name} = {payload.name}_' for payload in data['payload']])}
-                    WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
-                                AND rk = ins_rk;
-                    RAISE NOTICE 'HELLO';
+                -- the current k-th best value of the key: values that do not exceed it are
+                -- discarded, read with an index scan of at most {k} entries
+                SELECT {mrv.name} INTO threshold
+                FROM {table}_{mrv.name}
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
+                ORDER BY {mrv.name} DESC
+                OFFSET {k-1} ROWS
+                LIMIT 1;
+
+                IF threshold IS NULL OR threshold >= {mrv.name}_ THEN
+                    RETURN;
                 END IF;
+
+                -- the victim is the lowest node of the key, skipping the ones locked by other
+                -- writes (waiting for one only when all of them are locked)
+                SELECT rk INTO ins_rk
+                FROM {table}_{mrv.name}
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND {mrv.name} <= threshold
+                ORDER BY {mrv.name}
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED;
+
+                IF ins_rk IS NULL THEN
+                    SELECT rk INTO ins_rk
+                    FROM {table}_{mrv.name}
+                    WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND {mrv.name} < {mrv.name}_
+                    ORDER BY {mrv.name}
+                    LIMIT 1
+                    FOR UPDATE;
+                END IF;
+
+                UPDATE {table}_{mrv.name} 
+                SET {mrv.name} = {mrv.name}_, {', '.join([f'{payload.name} = {payload.name}_' for payload in data['payload']])}
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
+                            AND rk = ins_rk;
             END       
             $$ LANGUAGE plpgsql;
             ''')
 
-        # create insert procedure
+        # create insert procedure: a row of a key that already exists is written to its nodes as an
+        # update of the view is, and a new key gets its nodes on distinct random rks
         cursor.execute(f'''
             CREATE OR REPLACE FUNCTION insert_{table}({columns_str(data['all'], with_types=True, name_suffix='_new')}) RETURNS VOID
             AS $$
             BEGIN
-                IF (NOT EXISTS (SELECT {ids_str} FROM {table}_orig WHERE {' AND '.join([f'{pk.name} = {pk.name}_new' for pk in data['pk']])})) OR {k} = 1
+                IF EXISTS (SELECT {ids_str} FROM {table}_orig WHERE {' AND '.join([f'{pk.name} = {pk.name}_new' for pk in data['pk']])}) AND {k} > 1
                 THEN
-                    INSERT INTO {table}_orig 
-                    VALUES ({columns_str(data['not_mrv'], name_suffix='_new')});
-                END IF;
             '''
             +
             '\n'.join(f'''
-                INSERT INTO {table}_{mrv.name} VALUES({columns_str(data['pk'], name_suffix='_new')}, FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer, {', '.join([f'{payload.name}_new' for payload in data['payload']])}, {mrv.name}_new);
-            ''' for mrv in data['mrv'])       
+                    PERFORM topk_insert_{table}_{mrv.name}({columns_str(data['pk'], name_suffix='_new')}, FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer, {', '.join([f'{payload.name}_new' for payload in data['payload']])}, {mrv.name}_new);
+            ''' for mrv in data['mrv'])
+            +
+            f'''
+                    RETURN;
+                END IF;
+
+                INSERT INTO {table}_orig
+                VALUES ({columns_str(data['not_mrv'], name_suffix='_new')});
+            '''
             +
             '\n'.join(f'''
-                INSERT INTO {table}_{mrv.name} VALUES({columns_str(data['pk'], name_suffix='_new')}, FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer, {', '.join([f'{payload.name}_new' for payload in data['payload']])}, 0);
-            ''' for i in range(1,max(k, initial_nodes)) for mrv in data['mrv'])       
+                INSERT INTO {table}_{mrv.name}
+                SELECT {columns_str(data['pk'], name_suffix='_new')}, R.rk, {', '.join([f'{payload.name}_new' for payload in data['payload']])},
+                       CASE WHEN R.i = 1 THEN {mrv.name}_new ELSE 0 END
+                FROM (SELECT rk, ROW_NUMBER() OVER () AS i
+                      FROM (SELECT generate_series(0, {model['maxNodes']}) AS rk ORDER BY RANDOM() LIMIT {max(k, initial_nodes)}) AS S) AS R;
+            ''' for mrv in data['mrv'])
             +
             '''
             END
@@ -343,57 +401,20 @@ for table_data in model['tables']:
         ''')
 
 
-        # create insert rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "insert_{table}_rule" AS
-            ON INSERT TO {table}
-            DO INSTEAD SELECT insert_{table}({columns_str(data['all'], name_prefix='NEW.', with_cast=True)})
-        ''')
-
+        # create the write path of the view (INSTEAD OF trigger or rules)
+        for statement in write_path(model, table,
+                                    columns_str(data['all'], name_prefix='NEW.', with_cast=True),
+                                    columns_str(data['all'], name_prefix='NEW.', with_cast=True) + ', ' +
+                                    columns_str(data['all'], name_prefix='OLD.', with_cast=True),
+                                    columns_str(data['pk'], name_prefix='OLD.', with_cast=True)):
+            cursor.execute(statement)
 
-        # create update rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "update_{table}_rule" AS
-            ON UPDATE TO {table}
-            DO INSTEAD SELECT update_{table}(
-                {columns_str(data['all'], name_prefix='NEW.', with_cast=True)},
-                {columns_str(data['all'], name_prefix='OLD.', with_cast=True)})
-        ''')
 
-        # create delete rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "delete_{table}_rule" AS
-            ON DELETE TO {table}
-            DO INSTEAD SELECT delete_{table}({columns_str(data['pk'], name_prefix='OLD.', with_cast=True)})
-        ''')
-
-    # create mrv size function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_size(tablename varchar, columnname varchar, pk varchar) RETURNS int
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret int;
-        BEGIN
-            EXECUTE 'SELECT count(*) FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
-    
-    # create mrv total function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_total(tablename varchar, columnname varchar, pk varchar) RETURNS numeric
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret numeric;
-        BEGIN
-            EXECUTE 'SELECT sum(' || columnname || ') FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
-
-conn.commit()
-conn.close()
-
-print('Done')
+if __name__ == '__main__':
+    args = parse_args()
+    model = load_model(args)
+    if model['nodeGeneration'] == 'sql' or args.emit_sql is not None:
+        exit("nodeGeneration 'sql' (and so --emit-sql) is not supported by the ntopk converter")
+    if model['rkLayout'] == 'dense':
+        exit("rkLayout 'dense' is not supported by the ntopk converter (its workers add and remove nodes)")
+    convert_model(model, (prepare_table, load_table, index_table, finish_table), ('mrv_size', 'mrv_total'), args)
@@ -1,30 +1,15 @@
 # Converts the columns provided in the model file into multi record values (PostgreSQL only)
-# Usage: python3 convert_model.py <model-yml> [<initial-nodes>]
+# Usage: python3 convert_model.py <model-yml> [<initial-nodes>] [--jobs N] [--ranges N] [--online] [--checkpoint] [--resume]
+#        [--catalog FILE] [--emit-sql FILE] [--ingest TABLE FILE]
 
-import psycopg2
-from psycopg2.extras import execute_values
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import yaml
 import sys
 from collections import defaultdict
-import random
 import re
+import os
 
-
-type_translation = {
-    'character': 'varchar',
-    'smallint': 'integer'
-}
-
-# column in a relation
-class Column:
-    def __init__(self, name, type, nullable):
-        self.name = name
-        self.type = type_translation.get(type, type)
-        self.nullable = True if nullable == 'YES' else False
-
-    def __repr__(self):
-        return f'name: {self.name}, type: {self.type}, nullable: {self.nullable}'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from converter_utils import parse_args, load_model, convert_model, describe_table, write_path, lookup_functions, sample_rks, stream_batches, load_rows, load_query, random_rks_sql
 
 
 def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='', with_cast=False):
@@ -35,49 +20,34 @@ def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='
         return join.join([name_prefix + x.name + name_suffix + '::' + x.type for x in data])
 
 
-if len(sys.argv) < 2:
-    exit('Usage: python3 convert_model.py <model-yml> [<initial-nodes>]')
-
-
-model_file = sys.argv[1]
-with open(model_file) as f:
-    model = yaml.load(f, Loader=yaml.FullLoader)
-
-if len(sys.argv) >= 3:
-    model['initialNodes'] = min(int(sys.argv[2]), model['maxNodes'])
+# generates the initial nodes of each (pk, counter) row: each node holds one of
+# the next counter values, all of them valid
+def generate_nodes(batches, model):
+    initial_nodes = model['initialNodes']
+    for batch in batches:
+        batch_rks = sample_rks(len(batch), model['maxNodes'], initial_nodes - 1).tolist()
+        for row, rks in zip(batch, batch_rks):
+            # a NULL counter starts at 0, as the one of a row inserted into the view
+            value = row[-1] if row[-1] is not None else 0
+            pk = row[:-1]
 
-conn = psycopg2.connect(dbname=model['database'], host=model['host'], port=model['port'],
-                        user=model['user'], password=model['password'])
-cursor = conn.cursor()
-cursor.execute(f"SET search_path TO {model['schema']}")
+            for i, rk in enumerate(rks):
+                yield pk + (rk,) + (value + i, True)
 
 
-for table_data in model['tables']:
+# describes a table of the model, renames it and creates its new tables; with primary_keys=False
+# the primary keys are only created by index_table, after the data is loaded, and with online=True
+# the table keeps its name (and stays writable) until it is replaced by the view
+def prepare_table(cursor, model, table_data, primary_keys=True, online=False):
     data = {}
     table = table_data['name']
     print(f"Processing table '{table}'")
     mvn_names = set(table_data['mrv'])
     
-    # all columns
-    cursor.execute(f'''
-        SELECT column_name, data_type, is_nullable
-        FROM information_schema.columns
-        WHERE table_schema = '{model['schema']}'
-        AND table_name = '{table}';
-    ''')
-    all_columns = [Column(x[0], x[1], x[2]) for x in cursor.fetchall()]
-
-
-    # primary keys
-    cursor.execute(f'''
-        SELECT a.attname
-        FROM   pg_index i
-        JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                            AND a.attnum = ANY(i.indkey)
-        WHERE  i.indrelid = '{table}'::regclass
-        AND    i.indisprimary;
-    ''')
-    primary_keys_names = set([x[0] for x in cursor.fetchall()])
+    # all columns and primary keys, from the catalog
+    description = describe_table(cursor, model, table)
+    all_columns = description.columns()
+    primary_keys_names = set(description.primary_key)
 
     # store primary, regular and mrv columns for future uses
     data['pk'] = [x for x in all_columns if x.name in primary_keys_names]
@@ -87,13 +57,19 @@ for table_data in model['tables']:
     data['mrv'] = [x for x in all_columns if x.name in mvn_names]
     data['not_mrv'] = [x for x in all_columns if x.name not in mvn_names]
     data['all'] = all_columns
+    data['rename'] = f'{table}_orig'
+    data['source'] = table if online else data['rename']
+    data['deferred_keys'] = not primary_keys
+    # the new tables are only made logged once they are loaded and indexed
+    unlogged = 'UNLOGGED ' if model['unloggedLoad'] else ''
 
     
     # rename table
-    cursor.execute(f'''
-        ALTER TABLE {table}
-        RENAME TO {table}_orig
-    ''')
+    if not online:
+        cursor.execute(f'''
+            ALTER TABLE {table}
+            RENAME TO {data['rename']}
+        ''')
 
     # create main table
     #cursor.execute(f'''
@@ -129,28 +105,56 @@ for table_data in model['tables']:
     for mrv in data['mrv']:
         # create table
         cursor.execute(f'''
-            CREATE TABLE {table}_{mrv.name} (
+            CREATE {unlogged}TABLE {table}_{mrv.name} (
                 {columns_str(data['pk'], with_types=True)},
                 rk int,
                 {mrv.name} {mrv.type},
-                valid boolean,
-                PRIMARY KEY ({columns_str(data['pk'])}, rk)
+                valid boolean''' + (f''',
+                PRIMARY KEY ({columns_str(data['pk'])}, rk)''' if primary_keys else '') + '''
             )''')
+
+    data['shadows'] = [f'{table}_{mrv.name}' for mrv in data['mrv']]
+    return data
+
+
+# creates the initial nodes of the rows of the original table that match 'where'
+def load_table(conn, cursor, model, table_data, data, where='TRUE'):
+    table = table_data['name']
+
+    for mrv in data['mrv']:
         # move data
-        cursor.execute(f"SELECT {columns_str(data['pk'])}, {mrv.name} FROM {table}_orig")
-        inserts_rows = []
         initial_nodes = model['initialNodes']
-        for row in cursor:
-            value = row[-1]
-            pk = row[:-1]
-            
-            rks = [x for x in range(model['maxNodes'])]
-            for i in range(initial_nodes - 1):
-                rk = rks[random.randrange(len(rks))]
-                rks.remove(rk)
-                insert_row = pk + (rk,) + (value + i, True)
-                inserts_rows.append(insert_row)
-        execute_values(cursor, f"INSERT INTO {table}_{mrv.name} VALUES %s", inserts_rows)
+        if model['nodeGeneration'] == 'sql':
+            load_query(cursor, f'{table}_{mrv.name}', f'''
+                SELECT {columns_str(data['pk'], name_prefix='S.')}, N.rk, coalesce(S.{mrv.name}, 0) + N.i - 1, True
+                FROM (SELECT * FROM {data['source']} WHERE {where}) AS S
+                {random_rks_sql(model['maxNodes'], initial_nodes - 1, f"S.{data['pk'][0].name} IS NOT NULL")}
+            ''')
+        else:
+            batches = stream_batches(conn, f'{table}_{mrv.name}_stream',
+                                     f"SELECT {columns_str(data['pk'])}, {mrv.name} FROM {data['source']} WHERE {where}",
+                                     model['fetchSize'])
+            load_rows(cursor, f'{table}_{mrv.name}', generate_nodes(batches, model), model)
+
+
+# returns the statements that create the deferred primary keys, one list per table
+def index_table(cursor, model, table_data, data):
+    table = table_data['name']
+    statements = {f'{table}_{mrv.name}': [] for mrv in data['mrv']}
+
+    if data['deferred_keys']:
+        for mrv in data['mrv']:
+            statements[f'{table}_{mrv.name}'].append(f"ALTER TABLE {table}_{mrv.name} ADD PRIMARY KEY ({columns_str(data['pk'])}, rk)")
+
+    return list(statements.values())
+
+
+# replaces the original table with the view and creates its functions and write path
+def finish_table(cursor, model, table_data, data):
+    table = table_data['name']
+    initial_nodes = model['initialNodes']
+    # the view and functions below are built for the last mrv column
+    mrv = data['mrv'][-1]
 
     # remove aux table
     
@@ -171,11 +175,35 @@ for table_data in model['tables']:
         ON 
         {' AND '.join([f'{table}_orig.{pk.name} = T.{pk.name}' for pk in data['pk']])}
     ''')
+
+    # point lookups of the view, reading only the nodes of the given keys
+    def rows(match):
+        return f'''
+            SELECT OG.*, T.{mrv.name}
+            FROM {table}_orig AS OG
+            CROSS JOIN LATERAL (
+                SELECT MIN({mrv.name}) AS {mrv.name} FROM {table}_{mrv.name} AS N
+                WHERE valid = true AND {' AND '.join([f'N.{pk.name} = OG.{pk.name}' for pk in data['pk']])}
+                HAVING count(*) > 0
+            ) AS T
+            WHERE {match('OG')}'''
+
+    for statement in lookup_functions(table, f'{table}_serial', data['pk'], rows):
+        cursor.execute(statement)
     
     
 
 
     for mrv in data['mrv']:
+        # keys with consumed nodes, queued (once) for the worker refresh
+        cursor.execute(f'''
+            CREATE TABLE {table}_{mrv.name}_dirty (
+                {columns_str(data['pk'], with_types=True)},
+                PRIMARY KEY ({columns_str(data['pk'])})
+            )''')
+
+        # consumes a node of the key, returning its counter value, and queues the key (before locking
+        # the node, and kept FOR SHARE until commit), notifying <table>_<mrv>_dirty when it is new
         cursor.execute(f'''
             CREATE OR REPLACE FUNCTION {table}_{mrv.name}({columns_str(data['pk'], name_suffix='_', with_types=True)}) 
             RETURNS TABLE (
@@ -200,6 +228,22 @@ for table_data in model['tables']:
                 IF NOT FOUND THEN 
                     RETURN;
                 ELSE
+                    LOOP
+                        PERFORM 1
+                        FROM {table}_{mrv.name}_dirty AS D
+                        WHERE {' AND '.join([f'D.{pk.name} = {pk.name}_' for pk in data['pk']])}
+                        FOR SHARE;
+                        EXIT WHEN FOUND;
+
+                        INSERT INTO {table}_{mrv.name}_dirty
+                        VALUES ({columns_str(data['pk'], name_suffix='_')})
+                        ON CONFLICT DO NOTHING;
+                        IF FOUND THEN
+                            PERFORM pg_notify('{table}_{mrv.name}_dirty', '');
+                            EXIT;
+                        END IF;
+                    END LOOP;
+
                     UPDATE {table}_{mrv.name} AS T
                     SET valid = FALSE
                     WHERE {' AND '.join([f'T.{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk = node_rk;
@@ -223,7 +267,7 @@ for table_data in model['tables']:
                 INSERT INTO {table}_{mrv.name}
                 VALUES ({columns_str(data['pk'], name_suffix='_new')}, 
                         FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer,
-                        0, True, False);
+                        0, True);
             ''' for mrv in data['mrv']) 
             +
             '''
@@ -271,61 +315,99 @@ for table_data in model['tables']:
             $$ LANGUAGE plpgsql;
         ''')
 
-        # create insert rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "insert_{table}_rule" AS
-            ON INSERT TO {table}
-            DO INSTEAD SELECT insert_{table}({columns_str(data['not_mrv'], name_prefix='NEW.', with_cast=True)})
-        ''')
+        # create the write path of the view (INSTEAD OF trigger or rules)
+        for statement in write_path(model, table,
+                                    columns_str(data['not_mrv'], name_prefix='NEW.', with_cast=True),
+                                    columns_str(data['not_mrv'], name_prefix='NEW.', with_cast=True) + ', ' +
+                                    columns_str(data['not_mrv'], name_prefix='OLD.', with_cast=True),
+                                    columns_str(data['pk'], name_prefix='OLD.', with_cast=True)):
+            cursor.execute(statement)
+
+        # the refreshes of a key are serialized by an advisory lock of the key, not by locking its
+        # nodes, which its consumers would then wait for
+        lock = f"hashtext('{table}_{mrv.name}')"
 
-        # create update rule
+        # worker update function: gives the invalid (consumed) nodes of the key the next counter
+        # values, numbered by a window function in a single update instead of one update per node
         cursor.execute(f'''
-            CREATE OR REPLACE RULE "update_{table}_rule" AS
-            ON UPDATE TO {table}
-            DO INSTEAD SELECT update_{table}(
-                {columns_str(data['not_mrv'], name_prefix='NEW.', with_cast=True)},
-                {columns_str(data['not_mrv'], name_prefix='OLD.', with_cast=True)})
+            CREATE OR REPLACE FUNCTION refresh_{table}_{mrv.name}({columns_str(data['pk'], with_types=True, name_suffix='_')}) RETURNS VOID
+            AS $$
+            BEGIN
+                PERFORM pg_advisory_xact_lock({lock}, hashtext(ROW({columns_str(data['pk'], name_suffix='_')})::text));
+
+                WITH consumed AS (
+                    SELECT rk, (SELECT MAX({mrv.name}) FROM {table}_{mrv.name}
+                                WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])})
+                               + ROW_NUMBER() OVER (ORDER BY rk) AS counter
+                    FROM {table}_{mrv.name}
+                    WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND valid = FALSE
+                )
+                UPDATE {table}_{mrv.name} AS T
+                SET {mrv.name} = C.counter, valid = TRUE
+                FROM consumed AS C
+                WHERE {' AND '.join([f'T.{pk.name} = {pk.name}_' for pk in data['pk']])} AND T.rk = C.rk;
+            END
+            $$ LANGUAGE plpgsql;
         ''')
 
-        # create delete rule
+        # worker update function of many keys (one array per primary key column), returning the
+        # number of refreshed nodes
         cursor.execute(f'''
-            CREATE OR REPLACE RULE "delete_{table}_rule" AS
-            ON DELETE TO {table}
-            DO INSTEAD SELECT delete_{table}({columns_str(data['pk'], name_prefix='OLD.', with_cast=True)})
+            CREATE OR REPLACE FUNCTION refresh_{table}_{mrv.name}_batch({', '.join(f'{pk.name}_ {pk.type}[]' for pk in data['pk'])}) RETURNS int
+            AS $$
+            DECLARE d int;
+            BEGIN
+                -- in the order of the lock keys, so that concurrent batches do not deadlock
+                PERFORM pg_advisory_xact_lock({lock}, K.h)
+                FROM (SELECT DISTINCT hashtext(ROW({columns_str(data['pk'])})::text) AS h
+                      FROM unnest({columns_str(data['pk'], name_suffix='_')}) AS B({columns_str(data['pk'])})
+                      ORDER BY h) AS K;
+
+                WITH batch AS (
+                    SELECT DISTINCT * FROM unnest({columns_str(data['pk'], name_suffix='_')}) AS B({columns_str(data['pk'])})
+                ), bases AS (
+                    SELECT {columns_str(data['pk'], name_prefix='T.')}, MAX(T.{mrv.name}) AS base
+                    FROM {table}_{mrv.name} AS T JOIN batch AS B USING ({columns_str(data['pk'])})
+                    GROUP BY {columns_str(data['pk'], name_prefix='T.')}
+                ), consumed AS (
+                    SELECT {columns_str(data['pk'], name_prefix='T.')}, T.rk,
+                           ROW_NUMBER() OVER (PARTITION BY {columns_str(data['pk'], name_prefix='T.')} ORDER BY T.rk) AS i
+                    FROM {table}_{mrv.name} AS T JOIN batch AS B USING ({columns_str(data['pk'])})
+                    WHERE T.valid = FALSE
+                ), updated AS (
+                    UPDATE {table}_{mrv.name} AS T
+                    SET {mrv.name} = M.base + C.i, valid = TRUE
+                    FROM consumed AS C JOIN bases AS M USING ({columns_str(data['pk'])})
+                    WHERE {' AND '.join([f'T.{pk.name} = C.{pk.name}' for pk in data['pk']])} AND T.rk = C.rk
+                    RETURNING 1
+                )
+                SELECT count(*) FROM updated INTO d;
+                RETURN d;
+            END
+            $$ LANGUAGE plpgsql;
         ''')
 
-        # worker update function
+        # worker refresh of the queued keys: takes up to batch_size queued keys (skipping the ones
+        # taken by another call or kept by a consumption) and refreshes them, returning their number
         cursor.execute(f'''
-            CREATE OR REPLACE FUNCTION refresh_{table}_{mrv.name}({columns_str(data['pk'], with_types=True, name_suffix='_')}) RETURNS VOID
+            CREATE OR REPLACE FUNCTION refresh_{table}_{mrv.name}_dirty(batch_size int DEFAULT 1000) RETURNS int
             AS $$
-            DECLARE max_counter int;
-                    node_rk int;
-                    done bool = FALSE;
-                    cur CURSOR FOR
-                        SELECT rk FROM {table}_{mrv.name}
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND valid = FALSE;
-
+            DECLARE {' '.join(f'{pk.name}_ {pk.type}[];' for pk in data['pk'])}
             BEGIN
-                SELECT MAX({mrv.name}) + 1 INTO max_counter 
-                FROM {table}_{mrv.name}
-                WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])};
-
-                OPEN cur;
-                WHILE NOT done LOOP
-                    FETCH cur INTO node_rk;
-                    IF NOT FOUND THEN 
-                        done = TRUE;
-                    ELSE
-                        UPDATE {table}_{mrv.name}
-                        SET {mrv.name} = max_counter, valid = TRUE
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk = node_rk;
-                        
-                        max_counter := max_counter + 1;
-                    END IF;
-                
-                END LOOP;
-
-                CLOSE cur;
+                WITH queued AS (
+                    DELETE FROM {table}_{mrv.name}_dirty
+                    WHERE ctid = ANY(ARRAY(SELECT ctid FROM {table}_{mrv.name}_dirty LIMIT batch_size FOR UPDATE SKIP LOCKED))
+                    RETURNING {columns_str(data['pk'])}
+                )
+                SELECT {', '.join(f'array_agg({pk.name})' for pk in data['pk'])}
+                INTO {columns_str(data['pk'], name_suffix='_')}
+                FROM queued;
+
+                IF {data['pk'][0].name}_ IS NULL THEN
+                    RETURN 0;
+                END IF;
+                PERFORM refresh_{table}_{mrv.name}_batch({columns_str(data['pk'], name_suffix='_')});
+                RETURN cardinality({data['pk'][0].name}_);
             END
             $$ LANGUAGE plpgsql;
         ''')
@@ -334,22 +416,12 @@ for table_data in model['tables']:
         cursor.execute(f'''
             CREATE VIEW {table}_{mrv.name}_pk AS
                 SELECT {columns_str(data['pk'])} FROM {table}_orig;
-        ''') 
-
-    # create mrv size function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_size(tablename varchar, columnname varchar, pk varchar) RETURNS int
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret int;
-        BEGIN
-            EXECUTE 'SELECT count(*) FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
+        ''')
 
-conn.commit()
-conn.close()
 
-print('Done')
+if __name__ == '__main__':
+    args = parse_args()
+    model = load_model(args)
+    if model['rkLayout'] == 'dense':
+        exit("rkLayout 'dense' is not supported by the serial converter (its workers add and remove nodes)")
+    convert_model(model, (prepare_table, load_table, index_table, finish_table), ('mrv_size',), args)
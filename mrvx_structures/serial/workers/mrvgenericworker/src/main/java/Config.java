@@ -31,6 +31,7 @@ public class Config {
     public List<String> monitorTables;
     public boolean refresh;
     public int refreshDelta;
+    public int refreshBatch;
     public List<String> refreshTables;
 
 
@@ -59,6 +60,7 @@ public class Config {
                 ", monitorTables=" + monitorTables +
                 ", refresh=" + refresh +
                 ", refreshDelta=" + refreshDelta +
+                ", refreshBatch=" + refreshBatch +
                 ", refreshTables=" + refreshTables +
                 '}';
     }
@@ -1,8 +1,12 @@
+import org.postgresql.PGConnection;
+
 import java.sql.*;
+import java.util.LinkedHashMap;
+import java.util.Map;
 
 
 /**
- * Refreshes the counter values
+ * Refreshes the counter values of the keys queued by the node consumption functions
  */
 public class RefreshWorker implements Runnable {
 
@@ -18,44 +22,48 @@ public class RefreshWorker implements Runnable {
     }
 
     public void run() {
-        try {
-            Connection connection = DriverManager.getConnection(config.connectionString);
+        try (Connection connection = DriverManager.getConnection(config.connectionString)) {
             connection.setTransactionIsolation(Connection.TRANSACTION_REPEATABLE_READ);
             connection.setAutoCommit(false);
-            
-            PreparedStatement getPk;
-            ResultSet pkSet;
-            ResultSetMetaData pkSetMetaData;
-            PreparedStatement refresh;
-            StringBuilder sb;
-            int pkSetLength;
+            PGConnection pgConnection = connection.unwrap(PGConnection.class);
+
+            // the node consumption functions notify <table>_dirty when they queue a key
+            try (Statement listen = connection.createStatement()) {
+                for (String table_name: config.refreshTables) {
+                    listen.execute("LISTEN " + table_name + "_dirty");
+                }
+            }
+            connection.commit();
+
+            // the refresh of the queued keys of each table, prepared once (closed with the connection)
+            Map<String, PreparedStatement> refreshes = new LinkedHashMap<>();
+            for (String table_name: config.refreshTables) {
+                PreparedStatement refresh = connection.prepareStatement("SELECT refresh_" + table_name + "_dirty(?)");
+                refresh.setInt(1, config.refreshBatch);
+                refreshes.put(table_name, refresh);
+            }
+
+            int refreshed;
 
             while (true) {
-                for (String table_name: config.refreshTables){
+                for (PreparedStatement refresh: refreshes.values()){
                     try {
-                        getPk = connection.prepareStatement("SELECT * FROM " + table_name + "_pk");
-                        pkSet = getPk.executeQuery();
-                        pkSetMetaData = pkSet.getMetaData();
-                        pkSetLength = pkSetMetaData.getColumnCount();
-
-                        while (pkSet.next()) {
-                            sb = new StringBuilder();
-                            for (int i = 1; i <= pkSetLength; i++) {
-                                if (i > 1) sb.append(",  ");
-                                sb.append(pkSet.getString(i));
+                        // refreshes only the queued keys, one batch per transaction
+                        do {
+                            try (ResultSet refreshedSet = refresh.executeQuery()) {
+                                refreshedSet.next();
+                                refreshed = refreshedSet.getInt(1);
                             }
-                            refresh = connection.prepareCall("SELECT refresh_" + table_name + "(" + sb.toString() + ")");
-                            refresh.execute();
                             connection.commit();
-                        }
-                        
+                        } while (refreshed > 0);
                     }
                     catch (Exception e) {
                         connection.rollback();
                         e.printStackTrace();
                     }
                 }
-                Thread.sleep(config.refreshDelta);
+                // waits for the next notification, refreshing at least every refreshDelta ms
+                pgConnection.getNotifications(config.refreshDelta);
             }
         }
         catch (Exception e) {
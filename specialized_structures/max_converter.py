@@ -1,30 +1,15 @@
 # Converts the columns provided in the model file into multi record values (PostgreSQL only)
-# Usage: python3 convert_model.py <model-yml> [<initial-nodes>]
+# Usage: python3 convert_model.py <model-yml> [<initial-nodes>] [--jobs N] [--ranges N] [--online] [--checkpoint] [--resume]
+#        [--catalog FILE] [--emit-sql FILE] [--ingest TABLE FILE]
 
-import psycopg2
-from psycopg2.extras import execute_values
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import yaml
 import sys
 from collections import defaultdict
-import random
 import re
+import os
 
-
-type_translation = {
-    'character': 'varchar',
-    'smallint': 'integer'
-}
-
-# column in a relation
-class Column:
-    def __init__(self, name, type, nullable):
-        self.name = name
-        self.type = type_translation.get(type, type)
-        self.nullable = True if nullable == 'YES' else False
-
-    def __repr__(self):
-        return f'name: {self.name}, type: {self.type}, nullable: {self.nullable}'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from converter_utils import parse_args, load_model, convert_model, describe_table, write_path, lookup_functions, elide_write, bound_function, elision_counters, select_node, batch_update, node_rks, insert_rk, stream_batches, load_rows, load_query, node_rks_sql
 
 
 def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='', with_cast=False):
@@ -35,49 +20,36 @@ def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='
         return join.join([name_prefix + x.name + name_suffix + '::' + x.type for x in data])
 
 
-if len(sys.argv) < 2:
-    exit('Usage: python3 convert_model.py <model-yml> [<initial-nodes>]')
-
-
-model_file = sys.argv[1]
-with open(model_file) as f:
-    model = yaml.load(f, Loader=yaml.FullLoader)
-
-if len(sys.argv) >= 3:
-    model['initialNodes'] = min(int(sys.argv[2]), model['maxNodes'])
+# generates the initial nodes of each (pk, value) row: one node holds the value
+# and the remaining ones start at -inf
+def generate_nodes(batches, model):
+    initial_nodes = model['initialNodes']
+    min_inf = - 2147483648
+    for batch in batches:
+        batch_rks = node_rks(len(batch), model, initial_nodes).tolist()
+        for row, rks in zip(batch, batch_rks):
+            value = row[-1]
+            pk = row[:-1]
 
-conn = psycopg2.connect(dbname=model['database'], host=model['host'], port=model['port'],
-                        user=model['user'], password=model['password'])
-cursor = conn.cursor()
-cursor.execute(f"SET search_path TO {model['schema']}")
+            for rk in rks[:-1]:
+                yield pk + (rk,) + (min_inf,)
+            #leftover
+            yield pk + (rks[-1],) + (value,)
 
 
-for table_data in model['tables']:
+# describes a table of the model, renames it and creates its new tables; with primary_keys=False
+# the primary keys are only created by index_table, after the data is loaded, and with online=True
+# the table keeps its name (and stays writable) until it is replaced by the view
+def prepare_table(cursor, model, table_data, primary_keys=True, online=False):
     data = {}
     table = table_data['name']
     print(f"Processing table '{table}'")
     mvn_names = set(table_data['mrv'])
     
-    # all columns
-    cursor.execute(f'''
-        SELECT column_name, data_type, is_nullable
-        FROM information_schema.columns
-        WHERE table_schema = '{model['schema']}'
-        AND table_name = '{table}';
-    ''')
-    all_columns = [Column(x[0], x[1], x[2]) for x in cursor.fetchall()]
-
-
-    # primary keys
-    cursor.execute(f'''
-        SELECT a.attname
-        FROM   pg_index i
-        JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                            AND a.attnum = ANY(i.indkey)
-        WHERE  i.indrelid = '{table}'::regclass
-        AND    i.indisprimary;
-    ''')
-    primary_keys_names = set([x[0] for x in cursor.fetchall()])
+    # all columns and primary keys, from the catalog
+    description = describe_table(cursor, model, table)
+    all_columns = description.columns()
+    primary_keys_names = set(description.primary_key)
 
     # store primary, regular and mrv columns for future uses
     data['pk'] = [x for x in all_columns if x.name in primary_keys_names]
@@ -87,39 +59,27 @@ for table_data in model['tables']:
     data['mrv'] = [x for x in all_columns if x.name in mvn_names]
     data['not_mrv'] = [x for x in all_columns if x.name not in mvn_names]
     data['all'] = all_columns
+    data['indexes'] = description.indexes
+    data['rename'] = f'{table}__aux'
+    data['source'] = table if online else data['rename']
+    data['deferred_keys'] = not primary_keys
+    # the new tables are only made logged once they are loaded and indexed
+    unlogged = 'UNLOGGED ' if model['unloggedLoad'] else ''
 
     # rename table
-    cursor.execute(f'''
-        ALTER TABLE {table}
-        RENAME TO {table}__aux
-    ''')
+    if not online:
+        cursor.execute(f'''
+            ALTER TABLE {table}
+            RENAME TO {data['rename']}
+        ''')
 
     # create main table
     cursor.execute(f'''
-        CREATE TABLE {table}_orig (
-            {columns_str(data['not_mrv'], with_types=True)},
-            PRIMARY KEY({columns_str(data['pk'])})
+        CREATE {unlogged}TABLE {table}_orig (
+            {columns_str(data['not_mrv'], with_types=True)}''' + (f''',
+            PRIMARY KEY({columns_str(data['pk'])})''' if primary_keys else '') + '''
         )''')
 
-    # copy data to main table
-    cursor.execute(f'''
-        INSERT INTO {table}_orig (
-            SELECT {columns_str(data['not_mrv'])}
-            FROM {table}__aux
-        )''')
-
-    # recreate indexes
-    cursor.execute(f'''
-        SELECT indexdef
-        FROM pg_indexes
-        WHERE schemaname = 'public' AND tablename = '{table}__aux'
-    ''')
-    for index, in cursor.fetchall():
-        index = re.sub(f"{table}", f"{table}_orig", index)
-        index = re.sub(f"{table}_orig__aux", f"{table}_orig", index)
-        index = re.sub(r'CREATE\s*(UNIQUE)?\s*INDEX', r'CREATE \1 INDEX IF NOT EXISTS', index)
-        cursor.execute(index)
-
 
 #MAX STRUCTURE
 #rk, id, value pk(rk,id,value)
@@ -128,82 +88,295 @@ for table_data in model['tables']:
     for mrv in data['mrv']:
         # create table
         cursor.execute(f'''
-            CREATE TABLE {table}_{mrv.name} (
+            CREATE {unlogged}TABLE {table}_{mrv.name} (
                 {columns_str(data['pk'], with_types=True)},
                 rk int,
-                {mrv.name} {mrv.type},
-                PRIMARY KEY ({columns_str(data['pk'])}, rk)
+                {mrv.name} {mrv.type}''' + (f''',
+                PRIMARY KEY ({columns_str(data['pk'])}, rk)''' if primary_keys else '') + '''
             )''')
+
+        # with the dense rk layout, the number of nodes of each key (rks 0..n-1)
+        if model['rkLayout'] == 'dense':
+            cursor.execute(f'''
+                CREATE {unlogged}TABLE {table}_{mrv.name}_nodes (
+                    {columns_str(data['pk'], with_types=True)},
+                    n int''' + (f''',
+                    PRIMARY KEY ({columns_str(data['pk'])})''' if primary_keys else '') + '''
+                )''')
+
+        # with maxCache, the current maximum of each key
+        if model['maxCache']:
+            cursor.execute(f'''
+                CREATE {unlogged}TABLE {table}_{mrv.name}_max (
+                    {columns_str(data['pk'], with_types=True)},
+                    {mrv.name} {mrv.type}''' + (f''',
+                    PRIMARY KEY ({columns_str(data['pk'])})''' if primary_keys else '') + '''
+                )''')
+
+        # with elideWrites and no max cache (the bound otherwise), a lower bound of the maximum of each key
+        if model['elideWrites'] and not model['maxCache']:
+            cursor.execute(f'''
+                CREATE {unlogged}TABLE {table}_{mrv.name}_bound (
+                    {columns_str(data['pk'], with_types=True)},
+                    {mrv.name} {mrv.type}''' + (f''',
+                    PRIMARY KEY ({columns_str(data['pk'])})''' if primary_keys else '') + '''
+                )''')
+
+    data['shadows'] = [f'{table}_orig'] + [f'{table}_{mrv.name}' for mrv in data['mrv']]
+    if model['rkLayout'] == 'dense':
+        data['shadows'] += [f'{table}_{mrv.name}_nodes' for mrv in data['mrv']]
+    if model['maxCache']:
+        data['shadows'] += [f'{table}_{mrv.name}_max' for mrv in data['mrv']]
+    elif model['elideWrites']:
+        data['shadows'] += [f'{table}_{mrv.name}_bound' for mrv in data['mrv']]
+    return data
+
+
+# copies the rows of the original table that match 'where' to the new tables
+def load_table(conn, cursor, model, table_data, data, where='TRUE'):
+    table = table_data['name']
+
+    # copy data to main table
+    cursor.execute(f'''
+        INSERT INTO {table}_orig (
+            SELECT {columns_str(data['not_mrv'])}
+            FROM {data['source']}
+            WHERE {where}
+        )''')
+
+    for mrv in data['mrv']:
         # move data
-        cursor.execute(f"SELECT {columns_str(data['pk'])}, {mrv.name} FROM {table}__aux")
-        inserts_rows = []
         initial_nodes = model['initialNodes']
-        for row in cursor:
-            value = row[-1]
-            pk = row[:-1]
-            min_inf = - 2147483648
-            
-                
-            rks = [x for x in range(model['maxNodes'])]
-            for _ in range(initial_nodes - 1):
-                rk = rks[random.randrange(len(rks))]
-                rks.remove(rk)
-                insert_row = pk + (rk,) + (min_inf,)
-                inserts_rows.append(insert_row)
-            #leftover
-            rk = rks[random.randrange(len(rks))]
-            insert_row = pk + (rk,) + (value,)
-            inserts_rows.append(insert_row)
-        execute_values(cursor, f"INSERT INTO {table}_{mrv.name} VALUES %s", inserts_rows)
+        if model['nodeGeneration'] == 'sql':
+            load_query(cursor, f'{table}_{mrv.name}', f'''
+                SELECT {columns_str(data['pk'], name_prefix='S.')}, N.rk,
+                       CASE WHEN N.i = 1 THEN S.{mrv.name} ELSE - 2147483648 END
+                FROM (SELECT * FROM {data['source']} WHERE {where}) AS S
+                {node_rks_sql(model, initial_nodes, f"S.{data['pk'][0].name} IS NOT NULL")}
+            ''')
+        else:
+            batches = stream_batches(conn, f'{table}_{mrv.name}_stream',
+                                     f"SELECT {columns_str(data['pk'])}, {mrv.name} FROM {data['source']} WHERE {where}",
+                                     model['fetchSize'])
+            load_rows(cursor, f'{table}_{mrv.name}', generate_nodes(batches, model), model)
+
+        if model['rkLayout'] == 'dense':
+            cursor.execute(f'''
+                INSERT INTO {table}_{mrv.name}_nodes
+                SELECT {columns_str(data['pk'])}, {initial_nodes}
+                FROM {data['source']}
+                WHERE {where}
+            ''')
+
+        # the maximum of the nodes just created: the value, or -inf when it is null and there are
+        # other nodes
+        if model['maxCache']:
+            cursor.execute(f'''
+                INSERT INTO {table}_{mrv.name}_max
+                SELECT {columns_str(data['pk'])}, {f'GREATEST({mrv.name}, - 2147483648)' if initial_nodes > 1 else mrv.name}
+                FROM {data['source']}
+                WHERE {where}
+            ''')
+        elif model['elideWrites']:
+            cursor.execute(f'''
+                INSERT INTO {table}_{mrv.name}_bound
+                SELECT {columns_str(data['pk'])}, {mrv.name}
+                FROM {data['source']}
+                WHERE {where}
+            ''')
+
+
+# returns the statements that create the deferred primary keys and the indexes of the original
+# table, one list per table
+def index_table(cursor, model, table_data, data):
+    table = table_data['name']
+    statements = {f'{table}_orig': []}
+    statements.update({f'{table}_{mrv.name}': [] for mrv in data['mrv']})
+
+    if data['deferred_keys']:
+        statements[f'{table}_orig'].append(f"ALTER TABLE {table}_orig ADD PRIMARY KEY ({columns_str(data['pk'])})")
+        for mrv in data['mrv']:
+            statements[f'{table}_{mrv.name}'].append(f"ALTER TABLE {table}_{mrv.name} ADD PRIMARY KEY ({columns_str(data['pk'])}, rk)")
+            if model['rkLayout'] == 'dense':
+                statements[f'{table}_{mrv.name}_nodes'] = [f"ALTER TABLE {table}_{mrv.name}_nodes ADD PRIMARY KEY ({columns_str(data['pk'])})"]
+            if model['maxCache']:
+                statements[f'{table}_{mrv.name}_max'] = [f"ALTER TABLE {table}_{mrv.name}_max ADD PRIMARY KEY ({columns_str(data['pk'])})"]
+            elif model['elideWrites']:
+                statements[f'{table}_{mrv.name}_bound'] = [f"ALTER TABLE {table}_{mrv.name}_bound ADD PRIMARY KEY ({columns_str(data['pk'])})"]
+
+    # recreate indexes
+    for index in data['indexes']:
+        index = re.sub(f"{table}", f"{table}_orig", index)
+        index = re.sub(f"{table}_orig__aux", f"{table}_orig", index)
+        index = re.sub(r'CREATE\s*(UNIQUE)?\s*INDEX', r'CREATE \1 INDEX IF NOT EXISTS', index)
+        statements[f'{table}_orig'].append(index)
+
+    return list(statements.values())
+
+
+# replaces the original table with the view and creates its functions and write path
+def finish_table(cursor, model, table_data, data):
+    table = table_data['name']
+    initial_nodes = model['initialNodes']
 
     # remove aux table
     cursor.execute(f'DROP TABLE {table}__aux')
 
     # create view
     selects = []
+    joins = []
     for mrv in data['mrv']:
         s = f'(SELECT MAX({mrv.name}) AS {mrv.name} FROM {table}_{mrv.name} WHERE '
         wheres = [f'{table}_{mrv.name}.{pk.name} = {table}_orig.{pk.name}' for pk in data['pk']]
         s += ' AND '.join(wheres) + ')'
+        if model['maxCache']:
+            # read the cached maximum, unless the key is queued to have it refreshed
+            cursor.execute(f'''
+                CREATE TABLE {table}_{mrv.name}_max_dirty (
+                    {columns_str(data['pk'], with_types=True)},
+                    PRIMARY KEY ({columns_str(data['pk'])})
+                )''')
+            s = f"CASE WHEN D_{mrv.name}.{data['pk'][0].name} IS NULL THEN M_{mrv.name}.{mrv.name} ELSE {s} END AS {mrv.name}"
+            for alias, source in ((f'M_{mrv.name}', f'{table}_{mrv.name}_max'),
+                                  (f'D_{mrv.name}', f'{table}_{mrv.name}_max_dirty')):
+                joins.append(f'LEFT JOIN {source} AS {alias} ON ' +
+                             ' AND '.join([f'{alias}.{pk.name} = {table}_orig.{pk.name}' for pk in data['pk']]))
         selects.append(s)
 
     cursor.execute(f'''
         CREATE VIEW {table} AS
         SELECT {table}_orig.*, {','.join(selects)}
         FROM {table}_orig
+        {' '.join(joins)}
     ''')
 
+    # point lookups of the view, reading only the nodes of the given keys
+    def rows(match):
+        return f'''
+            SELECT {table}_orig.*, {','.join(selects)}
+            FROM {table}_orig
+            {' '.join(joins)}
+            WHERE {match(f'{table}_orig')}'''
+
+    for statement in lookup_functions(table, f'{table}_max', data['pk'], rows):
+        cursor.execute(statement)
+
 
     
     for mrv in data['mrv']:
+        # counts the writes that found every node locked
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {table}_{mrv.name}_waits')
+        for statement in elision_counters(model, f'{table}_{mrv.name}'):
+            cursor.execute(statement)
+        bound = f'{table}_{mrv.name}_max' if model['maxCache'] else f'{table}_{mrv.name}_bound'
+        # the maximum just written to a node of a key: the cache is the bound when there is one
+        if model['maxCache']:
+            raise_bound = f'raise_{table}_{mrv.name}_max'
+        elif model['elideWrites']:
+            raise_bound = f'raise_{table}_{mrv.name}_bound'
+            cursor.execute(bound_function(f'{table}_{mrv.name}', data['pk'], mrv.name, mrv.type))
+        else:
+            raise_bound = None
+
+        if model['maxCache']:
+            key = ' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])
+            # raises the cached maximum of a key to a value just written, without waiting for its row:
+            # when it is locked the key is queued (and kept FOR SHARE until the write commits) instead
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION raise_{table}_{mrv.name}_max({columns_str(data['pk'], name_suffix='_', with_types=True)}, {mrv.name}_ {mrv.type}) RETURNS boolean
+                AS $$
+                DECLARE cached {mrv.type};
+                BEGIN
+                    SELECT {mrv.name} INTO cached
+                    FROM {table}_{mrv.name}_max
+                    WHERE {key};
+
+                    IF cached IS NOT NULL AND {mrv.name}_ <= cached THEN
+                        RETURN TRUE;
+                    END IF;
+
+                    PERFORM 1
+                    FROM {table}_{mrv.name}_max
+                    WHERE {key}
+                    FOR UPDATE SKIP LOCKED;
+
+                    IF FOUND THEN
+                        DELETE FROM {table}_{mrv.name}_max_dirty
+                        WHERE ctid = ANY(ARRAY(SELECT ctid FROM {table}_{mrv.name}_max_dirty WHERE {key} FOR UPDATE SKIP LOCKED));
+
+                        IF FOUND THEN
+                            UPDATE {table}_{mrv.name}_max
+                            SET {mrv.name} = GREATEST({mrv.name}, {mrv.name}_, (SELECT MAX({mrv.name}) FROM {table}_{mrv.name} WHERE {key}))
+                            WHERE {key};
+                        ELSE
+                            UPDATE {table}_{mrv.name}_max
+                            SET {mrv.name} = {mrv.name}_
+                            WHERE {key}
+                            AND ({mrv.name} IS NULL OR {mrv.name}_ > {mrv.name});
+                        END IF;
+                        RETURN TRUE;
+                    END IF;
+
+                    LOOP
+                        PERFORM 1
+                        FROM {table}_{mrv.name}_max_dirty
+                        WHERE {key}
+                        FOR SHARE;
+                        EXIT WHEN FOUND;
+
+                        INSERT INTO {table}_{mrv.name}_max_dirty
+                        VALUES ({columns_str(data['pk'], name_suffix='_')})
+                        ON CONFLICT DO NOTHING;
+                        EXIT WHEN FOUND;
+                    END LOOP;
+                    RETURN FALSE;
+                END
+                $$ LANGUAGE plpgsql;
+            ''')
+
         #Write MAX
         cursor.execute(f'''
             CREATE OR REPLACE FUNCTION max_{table}_{mrv.name}({columns_str(data['pk'], name_suffix='_', with_types=True)}, rk_ int, {mrv.name}_ {mrv.type}) RETURNS void 
             AS $$ 
             DECLARE rk_v integer;
-            BEGIN
-                SELECT rk INTO rk_v FROM( 
-                    (SELECT rk 
-                        FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk >= rk_ 
-                        ORDER BY rk 
-                        LIMIT 1) 
-                        UNION ALL 
-                        (SELECT MIN(rk) 
-                        FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}) 
-                    ) AS T
-                LIMIT 1; 
+            BEGIN'''
+                + elide_write(model, f'{table}_{mrv.name}', [pk.name for pk in data['pk']], bound, f'{mrv.name}_ <= {mrv.name}')
+                + select_node(model, f'{table}_{mrv.name}', [pk.name for pk in data['pk']], f'{mrv.name}_ > {mrv.name}') +
+                f'''
 
                 UPDATE {table}_{mrv.name} 
                 SET {mrv.name} = {mrv.name}_ 
                 WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk = rk_v
                             AND {mrv.name}_ > {mrv.name};
-
+''' + (f'''
+                IF FOUND THEN
+                    PERFORM {raise_bound}({columns_str(data['pk'], name_suffix='_')}, {mrv.name}_);
+                END IF;
+''' if raise_bound else '') + '''
             END
             $$ LANGUAGE plpgsql;
             ''')
 
+        # batch write: one node update per key, with the maximum of its values
+        cursor.execute(f'''
+            CREATE OR REPLACE FUNCTION max_{table}_{mrv.name}_batch({', '.join(f'{pk.name}_ {pk.type}[]' for pk in data['pk'])}, {mrv.name}_ {mrv.type}[]) RETURNS int
+            AS $$
+            DECLARE d int;
+            DECLARE waits int;
+            BEGIN'''
+                + batch_update(model, f'{table}_{mrv.name}', [pk.name for pk in data['pk']], [mrv.name], f'''
+                    SELECT {columns_str(data['pk'])}, MAX({mrv.name}) AS {mrv.name}
+                    FROM unnest({columns_str(data['pk'], name_suffix='_')}, {mrv.name}_) AS B({columns_str(data['pk'])}, {mrv.name})
+                    GROUP BY {columns_str(data['pk'])}''',
+                               f'{mrv.name} = N.{mrv.name}', f'N.{mrv.name} > T.{mrv.name}',
+                               f"{raise_bound}({columns_str(data['pk'])}, {mrv.name})" if raise_bound else None,
+                               (bound, f'G.{mrv.name} <= E.{mrv.name}')) +
+                '''
+                RETURN d;
+            END
+            $$ LANGUAGE plpgsql;
+        ''')
+
         # create insert procedure
         cursor.execute(f'''
             CREATE OR REPLACE FUNCTION insert_{table}({columns_str(data['all'], with_types=True, name_suffix='_new')}) RETURNS VOID
@@ -216,16 +389,34 @@ for table_data in model['tables']:
             '\n'.join(f'''
                 INSERT INTO {table}_{mrv.name}
                 VALUES ({columns_str(data['pk'], name_suffix='_new')}, 
-                        FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer,
+                        {insert_rk(model, 0, f'{table}_{mrv.name}', [pk.name for pk in data['pk']])},
                         {mrv.name}_new);
             ''' for mrv in data['mrv']) 
             +
             '\n'.join(f'''
                 INSERT INTO {table}_{mrv.name}
                 VALUES ({columns_str(data['pk'], name_suffix='_new')}, 
-                        FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer,
+                        {insert_rk(model, i, f'{table}_{mrv.name}', [pk.name for pk in data['pk']])},
                         0);
-            ''' for mrv in data['mrv'] for _ in range(initial_nodes - 1)) 
+            ''' for mrv in data['mrv'] for i in range(1, initial_nodes)) 
+            +
+            '\n'.join(f'''
+                INSERT INTO {table}_{mrv.name}_nodes
+                VALUES ({columns_str(data['pk'], name_suffix='_new')}, {initial_nodes});
+            ''' for mrv in data['mrv'] if model['rkLayout'] == 'dense')
+            +
+            '\n'.join(f'''
+                INSERT INTO {table}_{mrv.name}_max
+                SELECT {columns_str(data['pk'])}, MAX({mrv.name})
+                FROM {table}_{mrv.name}
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_new' for pk in data['pk']])}
+                GROUP BY {columns_str(data['pk'])};
+            ''' for mrv in data['mrv'] if model['maxCache'])
+            +
+            '\n'.join(f'''
+                INSERT INTO {table}_{mrv.name}_bound
+                VALUES ({columns_str(data['pk'], name_suffix='_new')}, {mrv.name}_new);
+            ''' for mrv in data['mrv'] if model['elideWrites'] and not model['maxCache'])
             #TODO apagar os registos extra a 0, são bons para testes           
             +
             '''
@@ -274,6 +465,20 @@ for table_data in model['tables']:
                 DELETE FROM {table}_{mrv.name}
                 WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
             ''' for mrv in data['mrv']])
+            + '\n'.join([f'''
+                DELETE FROM {table}_{mrv.name}_nodes
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
+            ''' for mrv in data['mrv'] if model['rkLayout'] == 'dense'])
+            + '\n'.join([f'''
+                DELETE FROM {table}_{mrv.name}_max
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
+                DELETE FROM {table}_{mrv.name}_max_dirty
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
+            ''' for mrv in data['mrv'] if model['maxCache']])
+            + '\n'.join([f'''
+                DELETE FROM {table}_{mrv.name}_bound
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
+            ''' for mrv in data['mrv'] if model['elideWrites'] and not model['maxCache']])
             +
             '''
             END
@@ -281,57 +486,65 @@ for table_data in model['tables']:
         ''')
 
 
-        # create insert rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "insert_{table}_rule" AS
-            ON INSERT TO {table}
-            DO INSTEAD SELECT insert_{table}({columns_str(data['all'], name_prefix='NEW.', with_cast=True)})
-        ''')
-
-
-        # create update rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "update_{table}_rule" AS
-            ON UPDATE TO {table}
-            DO INSTEAD SELECT update_{table}(
-                {columns_str(data['all'], name_prefix='NEW.', with_cast=True)},
-                {columns_str(data['all'], name_prefix='OLD.', with_cast=True)})
-        ''')
-
-        # create delete rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "delete_{table}_rule" AS
-            ON DELETE TO {table}
-            DO INSTEAD SELECT delete_{table}({columns_str(data['pk'], name_prefix='OLD.', with_cast=True)})
-        ''')
+        # create the write path of the view (INSTEAD OF trigger or rules)
+        for statement in write_path(model, table,
+                                    columns_str(data['all'], name_prefix='NEW.', with_cast=True),
+                                    columns_str(data['all'], name_prefix='NEW.', with_cast=True) + ', ' +
+                                    columns_str(data['all'], name_prefix='OLD.', with_cast=True),
+                                    columns_str(data['pk'], name_prefix='OLD.', with_cast=True)):
+            cursor.execute(statement)
+
+        # recomputes the cached maximum of the queued keys not kept by running writes; meant to be
+        # scheduled, to catch up the keys that are not written again
+        if model['maxCache']:
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION refresh_{table}_{mrv.name}_max() RETURNS int
+                AS $$
+                DECLARE d int;
+                BEGIN
+                    WITH queued AS (
+                        DELETE FROM {table}_{mrv.name}_max_dirty
+                        WHERE ctid = ANY(ARRAY(SELECT ctid FROM {table}_{mrv.name}_max_dirty FOR UPDATE SKIP LOCKED))
+                        RETURNING {columns_str(data['pk'])}
+                    ), refreshed AS (
+                        UPDATE {table}_{mrv.name}_max AS M
+                        SET {mrv.name} = GREATEST(M.{mrv.name}, (SELECT MAX(N.{mrv.name}) FROM {table}_{mrv.name} AS N
+                                                                WHERE {' AND '.join([f'N.{pk.name} = M.{pk.name}' for pk in data['pk']])}))
+                        FROM queued AS Q
+                        WHERE {' AND '.join([f'M.{pk.name} = Q.{pk.name}' for pk in data['pk']])}
+                        RETURNING 1
+                    )
+                    SELECT count(*) INTO d FROM refreshed;
+                    RETURN d;
+                END
+                $$ LANGUAGE plpgsql;
+            ''')
 
-    # create mrv size function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_size(tablename varchar, columnname varchar, pk varchar) RETURNS int
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret int;
-        BEGIN
-            EXECUTE 'SELECT count(*) FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
-    
-    # create mrv total function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_total(tablename varchar, columnname varchar, pk varchar) RETURNS numeric
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret numeric;
-        BEGIN
-            EXECUTE 'SELECT sum(' || columnname || ') FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
+        # raises the bound of every key to the maximum of its nodes, catching up the skipped raises
+        if model['elideWrites'] and not model['maxCache']:
+            cursor.execute(f'''
+                CREATE OR REPLACE FUNCTION refresh_{table}_{mrv.name}_bound() RETURNS int
+                AS $$
+                DECLARE d int;
+                BEGIN
+                    WITH refreshed AS (
+                        UPDATE {table}_{mrv.name}_bound AS B
+                        SET {mrv.name} = N.{mrv.name}
+                        FROM (SELECT {columns_str(data['pk'])}, MAX({mrv.name}) AS {mrv.name}
+                              FROM {table}_{mrv.name}
+                              GROUP BY {columns_str(data['pk'])}) AS N
+                        WHERE {' AND '.join([f'B.{pk.name} = N.{pk.name}' for pk in data['pk']])}
+                        AND (B.{mrv.name} IS NULL OR N.{mrv.name} > B.{mrv.name})
+                        RETURNING 1
+                    )
+                    SELECT count(*) INTO d FROM refreshed;
+                    RETURN d;
+                END
+                $$ LANGUAGE plpgsql;
+            ''')
 
-conn.commit()
-conn.close()
 
-print('Done')
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args()
+    model = load_model(args)
+    convert_model(model, (prepare_table, load_table, index_table, finish_table), ('mrv_size', 'mrv_total'), args)
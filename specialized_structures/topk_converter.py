@@ -1,30 +1,15 @@
 # Converts the columns provided in the model file into multi record values (PostgreSQL only)
-# Usage: python3 convert_model.py <model-yml> [<initial-nodes>]
+# Usage: python3 convert_model.py <model-yml> [<initial-nodes>] [--jobs N] [--ranges N] [--online] [--checkpoint] [--resume]
+#        [--catalog FILE] [--emit-sql FILE] [--ingest TABLE FILE]
 
-import psycopg2
-from psycopg2.extras import execute_values
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import yaml
 import sys
 from collections import defaultdict
-import random
 import re
+import os
 
-
-type_translation = {
-    'character': 'varchar',
-    'smallint': 'integer'
-}
-
-# column in a relation
-class Column:
-    def __init__(self, name, type, nullable):
-        self.name = name
-        self.type = type_translation.get(type, type)
-        self.nullable = True if nullable == 'YES' else False
-
-    def __repr__(self):
-        return f'name: {self.name}, type: {self.type}, nullable: {self.nullable}'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from converter_utils import parse_args, load_model, convert_model, describe_table, write_path, lookup_functions, select_node, node_rks, insert_rk, stream_batches, load_rows, load_query, node_rks_sql
 
 
 def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='', with_cast=False):
@@ -35,49 +20,39 @@ def columns_str(data, with_types=False, join=', ', name_suffix='', name_prefix='
         return join.join([name_prefix + x.name + name_suffix + '::' + x.type for x in data])
 
 
-if len(sys.argv) < 2:
-    exit('Usage: python3 convert_model.py <model-yml> [<initial-nodes>]')
+# generates the initial nodes of each (pk, array) row: one node holds the array
+# and the remaining ones start empty
+def generate_nodes(batches, model):
+    initial_nodes = model['initialNodes']
+    for batch in batches:
+        batch_rks = node_rks(len(batch), model, initial_nodes).tolist()
+        for row, rks in zip(batch, batch_rks):
+            value = row[-1]
+            pk = row[:-1]
 
+            for rk in rks[:-1]:
+                yield pk + (rk,) + ([],)
 
-model_file = sys.argv[1]
-with open(model_file) as f:
-    model = yaml.load(f, Loader=yaml.FullLoader)
+            yield pk + (rks[-1],) + (value,)
 
-if len(sys.argv) >= 3:
-    model['initialNodes'] = min(int(sys.argv[2]), model['maxNodes'])
 
-conn = psycopg2.connect(dbname=model['database'], host=model['host'], port=model['port'],
-                        user=model['user'], password=model['password'])
-cursor = conn.cursor()
-cursor.execute(f"SET search_path TO {model['schema']}")
+# number of values kept by the top-k
+k = 5
 
 
-for table_data in model['tables']:
+# describes a table of the model, renames it and creates its new tables; with primary_keys=False
+# the primary keys are only created by index_table, after the data is loaded, and with online=True
+# the table keeps its name (and stays writable) until it is replaced by the view
+def prepare_table(cursor, model, table_data, primary_keys=True, online=False):
     data = {}
     table = table_data['name']
     print(f"Processing table '{table}'")
     mvn_names = set(table_data['mrv'])
     
-    # all columns
-    cursor.execute(f'''
-        SELECT column_name, udt_name, is_nullable
-        FROM information_schema.columns
-        WHERE table_schema = '{model['schema']}'
-        AND table_name = '{table}';
-    ''')
-    all_columns = [Column(x[0], x[1], x[2]) for x in cursor.fetchall()]
-
-
-    # primary keys
-    cursor.execute(f'''
-        SELECT a.attname
-        FROM   pg_index i
-        JOIN   pg_attribute a ON a.attrelid = i.indrelid
-                            AND a.attnum = ANY(i.indkey)
-        WHERE  i.indrelid = '{table}'::regclass
-        AND    i.indisprimary;
-    ''')
-    primary_keys_names = set([x[0] for x in cursor.fetchall()])
+    # all columns and primary keys, from the catalog
+    description = describe_table(cursor, model, table)
+    all_columns = description.columns(udt_names=True)
+    primary_keys_names = set(description.primary_key)
 
     # store primary, regular and mrv columns for future uses
     data['pk'] = [x for x in all_columns if x.name in primary_keys_names]
@@ -87,70 +62,118 @@ for table_data in model['tables']:
     data['mrv'] = [x for x in all_columns if x.name in mvn_names]
     data['not_mrv'] = [x for x in all_columns if x.name not in mvn_names]
     data['all'] = all_columns
-    k = 5
+    data['indexes'] = description.indexes
+    data['rename'] = f'{table}__aux'
+    data['source'] = table if online else data['rename']
+    data['deferred_keys'] = not primary_keys
+    # the new tables are only made logged once they are loaded and indexed
+    unlogged = 'UNLOGGED ' if model['unloggedLoad'] else ''
 
     # rename table
-    cursor.execute(f'''
-        ALTER TABLE {table}
-        RENAME TO {table}__aux
-    ''')
+    if not online:
+        cursor.execute(f'''
+            ALTER TABLE {table}
+            RENAME TO {data['rename']}
+        ''')
 
     # create main table
     cursor.execute(f'''
-        CREATE TABLE {table}_orig (
-            {columns_str(data['not_mrv'], with_types=True)},
-            PRIMARY KEY({columns_str(data['pk'])})
+        CREATE {unlogged}TABLE {table}_orig (
+            {columns_str(data['not_mrv'], with_types=True)}''' + (f''',
+            PRIMARY KEY({columns_str(data['pk'])})''' if primary_keys else '') + '''
         )''')
 
+    # create mrv tables
+    for mrv in data['mrv']:
+        # create table
+        cursor.execute(f'''
+            CREATE {unlogged}TABLE {table}_{mrv.name} (
+                {columns_str(data['pk'], with_types=True)},
+                rk int,
+                {mrv.name} {mrv.type}''' + (f''',
+                PRIMARY KEY ({columns_str(data['pk'])}, rk)''' if primary_keys else '') + '''
+            )''')
+
+        # with the dense rk layout, the number of nodes of each key (rks 0..n-1)
+        if model['rkLayout'] == 'dense':
+            cursor.execute(f'''
+                CREATE {unlogged}TABLE {table}_{mrv.name}_nodes (
+                    {columns_str(data['pk'], with_types=True)},
+                    n int''' + (f''',
+                    PRIMARY KEY ({columns_str(data['pk'])})''' if primary_keys else '') + '''
+                )''')
+
+    data['shadows'] = [f'{table}_orig'] + [f'{table}_{mrv.name}' for mrv in data['mrv']]
+    if model['rkLayout'] == 'dense':
+        data['shadows'] += [f'{table}_{mrv.name}_nodes' for mrv in data['mrv']]
+    return data
+
+
+# copies the rows of the original table that match 'where' to the new tables
+def load_table(conn, cursor, model, table_data, data, where='TRUE'):
+    table = table_data['name']
+
     # copy data to main table
     cursor.execute(f'''
         INSERT INTO {table}_orig (
             SELECT {columns_str(data['not_mrv'])}
-            FROM {table}__aux
+            FROM {data['source']}
+            WHERE {where}
         )''')
 
+    for mrv in data['mrv']:
+        # move data
+        initial_nodes = model['initialNodes']
+        if model['nodeGeneration'] == 'sql':
+            load_query(cursor, f'{table}_{mrv.name}', f'''
+                SELECT {columns_str(data['pk'], name_prefix='S.')}, N.rk,
+                       CASE WHEN N.i = 1 THEN S.{mrv.name} ELSE '{{}}' END
+                FROM (SELECT * FROM {data['source']} WHERE {where}) AS S
+                {node_rks_sql(model, initial_nodes, f"S.{data['pk'][0].name} IS NOT NULL")}
+            ''')
+        else:
+            batches = stream_batches(conn, f'{table}_{mrv.name}_stream',
+                                     f"SELECT {columns_str(data['pk'])}, {mrv.name} FROM {data['source']} WHERE {where}",
+                                     model['fetchSize'])
+            load_rows(cursor, f'{table}_{mrv.name}', generate_nodes(batches, model), model)
+
+        if model['rkLayout'] == 'dense':
+            cursor.execute(f'''
+                INSERT INTO {table}_{mrv.name}_nodes
+                SELECT {columns_str(data['pk'])}, {initial_nodes}
+                FROM {data['source']}
+                WHERE {where}
+            ''')
+
+
+# returns the statements that create the deferred primary keys and the indexes of the original
+# table, one list per table
+def index_table(cursor, model, table_data, data):
+    table = table_data['name']
+    statements = {f'{table}_orig': []}
+    statements.update({f'{table}_{mrv.name}': [] for mrv in data['mrv']})
+
+    if data['deferred_keys']:
+        statements[f'{table}_orig'].append(f"ALTER TABLE {table}_orig ADD PRIMARY KEY ({columns_str(data['pk'])})")
+        for mrv in data['mrv']:
+            statements[f'{table}_{mrv.name}'].append(f"ALTER TABLE {table}_{mrv.name} ADD PRIMARY KEY ({columns_str(data['pk'])}, rk)")
+            if model['rkLayout'] == 'dense':
+                statements[f'{table}_{mrv.name}_nodes'] = [f"ALTER TABLE {table}_{mrv.name}_nodes ADD PRIMARY KEY ({columns_str(data['pk'])})"]
+
     # recreate indexes
-    cursor.execute(f'''
-        SELECT indexdef
-        FROM pg_indexes
-        WHERE schemaname = 'public' AND tablename = '{table}__aux'
-    ''')
-    for index, in cursor.fetchall():
+    for index in data['indexes']:
         index = re.sub(f"{table}", f"{table}_orig", index)
         index = re.sub(f"{table}_orig__aux", f"{table}_orig", index)
         index = re.sub(r'CREATE\s*(UNIQUE)?\s*INDEX', r'CREATE \1 INDEX IF NOT EXISTS', index)
-        cursor.execute(index)
+        statements[f'{table}_orig'].append(index)
 
-    # create mrv tables
-    for mrv in data['mrv']:
-        # create table
-        cursor.execute(f'''
-            CREATE TABLE {table}_{mrv.name} (
-                {columns_str(data['pk'], with_types=True)},
-                rk int,
-                {mrv.name} {mrv.type},
-                PRIMARY KEY ({columns_str(data['pk'])}, rk)
-            )''')
-        # move data
-        cursor.execute(f"SELECT {columns_str(data['pk'])}, {mrv.name} FROM {table}__aux")
-        inserts_rows = []
-        initial_nodes = model['initialNodes']
-        for row in cursor:
-            value = row[-1]
-            pk = row[:-1]
-                
-            rks = [x for x in range(model['maxNodes'])]
-            for _ in range(initial_nodes - 1):
-                rk = rks[random.randrange(len(rks))]
-                rks.remove(rk)
-                insert_row = pk + (rk,) + ([],)
-                inserts_rows.append(insert_row)
-            
-            rk = rks[random.randrange(len(rks))]
-            rks.remove(rk)
-            insert_row = pk + (rk,) + (value,)
-            inserts_rows.append(insert_row)
-        execute_values(cursor, f"INSERT INTO {table}_{mrv.name} VALUES %s", inserts_rows)
+    return list(statements.values())
+
+
+# replaces the original table with the view and creates its functions and write path
+def finish_table(cursor, model, table_data, data):
+    table = table_data['name']
+    initial_nodes = model['initialNodes']
 
     # remove aux table
     cursor.execute(f'DROP TABLE {table}__aux')
@@ -185,94 +208,53 @@ for table_data in model['tables']:
 
     cursor.execute(view)
 
+    # point lookups of the view, reading only the nodes of the given keys
+    mrv = data['mrv'][0]
+    def rows(match):
+        return f'''
+            SELECT OG.*, T.{mrv.name}[GREATEST(array_length(T.{mrv.name}, 1) - {k} + 1, 1):]
+            FROM {table}_orig AS OG
+            CROSS JOIN LATERAL (
+                SELECT ARRAY_AGG(P.{mrv.name} ORDER BY P.{mrv.name} ASC) AS {mrv.name}
+                FROM {table}_{mrv.name} AS N, UNNEST(N.{mrv.name}) AS P({mrv.name})
+                WHERE {' AND '.join([f'N.{pk.name} = OG.{pk.name}' for pk in data['pk']])}
+                HAVING count(*) > 0
+            ) AS T
+            WHERE {match('OG')}'''
+
+    for statement in lookup_functions(table, f'{table}_topk', data['pk'], rows):
+        cursor.execute(statement)
+
 
     
     for mrv in data['mrv']:
+        # counts the writes that found every node locked
+        cursor.execute(f'CREATE SEQUENCE IF NOT EXISTS {table}_{mrv.name}_waits')
+
         #Write TOPK
         cursor.execute(f'''
             CREATE OR REPLACE FUNCTION topK_{table}_{mrv.name}({columns_str(data['pk'], name_suffix='_', with_types=True)}, rk_ int, {mrv.name}_ {mrv.type.lstrip('_')}) RETURNS void 
             AS $$ 
                 DECLARE    rk_v int;
-                DECLARE    arr_topk int[];
-                DECLARE    size int;
-                DECLARE    loop_i int;
-                DECLARE    loop_j int;
-                DECLARE    cur_value int;
-
-                BEGIN
-                    SELECT rk INTO rk_v FROM( 
-                    (SELECT rk 
-                        FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} AND rk >= rk_ 
-                        ORDER BY rk 
-                        LIMIT 1) 
-                        UNION ALL 
-                        (SELECT MIN(rk) 
-                        FROM {table}_{mrv.name} 
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}) 
-                    ) AS T
-                    LIMIT 1; 
-
-                    SELECT {mrv.name} INTO arr_topk
-                    FROM {table}_{mrv.name}
+
+                BEGIN'''
+                + select_node(model, f'{table}_{mrv.name}', [pk.name for pk in data['pk']], f'(coalesce(array_length({mrv.name}, 1), 0) < {k} OR {mrv.name}_ > {mrv.name}[1])') +
+                f'''
+
+                    -- merges {mrv.name}_ into the sorted array of the node, before its first value that
+                    -- is not smaller, and keeps its {k} largest values, in a single update (none when
+                    -- the array is full and {mrv.name}_ does not exceed its smallest value)
+                    UPDATE {table}_{mrv.name} 
+                    SET {mrv.name} = (
+                        SELECT M.merged[GREATEST(array_length(M.merged, 1) - {k} + 1, 1):]
+                        FROM (
+                            SELECT {mrv.name}[:P.position] || {mrv.name}_ || {mrv.name}[P.position + 1:] AS merged
+                            FROM (SELECT count(*)::int AS position FROM UNNEST({mrv.name}) AS V(v) WHERE V.v < {mrv.name}_) AS P
+                        ) AS M
+                    )
                     WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])} 
-                    AND rk = rk_v;
-                    
-                    SELECT array_length(arr_topk,1) INTO size;
-                    IF size IS NULL THEN
-                        size := 0;
-                    END IF;
-
-                    loop_i := 1;
-                    -- This IF block finds where to insert (if arr_topk is empty we insert in index 1)
-                    IF size > 0 THEN
-                        cur_value := arr_topk[loop_i];
-
-                        WHILE loop_i < size AND {mrv.name}_ > cur_value
-                        LOOP
-                            loop_i := loop_i + 1;
-                            cur_value := arr_topk[loop_i];
-                        END LOOP;
-
-                        IF {mrv.name}_ > cur_value THEN
-                            loop_i := loop_i + 1;
-                        END IF;
-                    END IF;
-                    
-
-                    IF size < {k} THEN
-                        -- TopK is not full
-                        -- Switch all values from size to loop_i with the next order value
-                        -- And insert {mrv.name}_ in the loop_i position
-                        FOR loop_j IN REVERSE size..loop_i LOOP
-                            UPDATE {table}_{mrv.name} 
-                            SET {mrv.name}[loop_j + 1] = {mrv.name}[loop_j]
-                            WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
-                            AND rk = rk_v;
-                        END LOOP;
-
-                        UPDATE {table}_{mrv.name} 
-                        SET {mrv.name}[loop_i] = {mrv.name}_
-                        WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
-                        AND rk = rk_v;
-                    ELSE
-                        -- TopK is full and cycle iterated atleast once so there is an element to insert
-                        -- Switch all values from 1 up to loop_i-2 with the previous order value
-                        -- Insert {mrv.name}_ in the loop_i-1 position
-                        IF loop_i > 1 THEN
-                            FOR loop_j IN 1..loop_i-2 LOOP
-                                UPDATE {table}_{mrv.name} 
-                                SET {mrv.name}[loop_j] = {mrv.name}[loop_j + 1]
-                                WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
-                                AND rk = rk_v;
-                            END LOOP;
-                            
-                            UPDATE {table}_{mrv.name} 
-                            SET {mrv.name}[loop_i-1] = {mrv.name}_
-                            WHERE {' AND '.join([f'{pk.name} = {pk.name}_' for pk in data['pk']])}
-                            AND rk = rk_v;
-                        END IF;
-                    END IF;
+                    AND rk = rk_v
+                    AND (coalesce(array_length({mrv.name}, 1), 0) < {k} OR {mrv.name}_ > {mrv.name}[1]);
             END
             $$ LANGUAGE plpgsql;
         ''')
@@ -288,8 +270,12 @@ for table_data in model['tables']:
             '''
             +
             '\n'.join(f'''
-                INSERT INTO {table}_{mrv.name} VALUES({columns_str(data['pk'], name_suffix='_new')}, FLOOR(RANDOM() * ({model['maxNodes']} + 1))::integer, {mrv.name}_new);
-            ''' for mrv in data['mrv'])       
+                INSERT INTO {table}_{mrv.name} VALUES({columns_str(data['pk'], name_suffix='_new')}, {insert_rk(model, 0, f'{table}_{mrv.name}', [pk.name for pk in data['pk']])}, {mrv.name}_new);
+            ''' for mrv in data['mrv'])
+            +
+            '\n'.join(f'''
+                INSERT INTO {table}_{mrv.name}_nodes VALUES({columns_str(data['pk'], name_suffix='_new')}, 1);
+            ''' for mrv in data['mrv'] if model['rkLayout'] == 'dense')       
             +
             '''
             END
@@ -344,6 +330,10 @@ for table_data in model['tables']:
                 DELETE FROM {table}_{mrv.name}
                 WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
             ''' for mrv in data['mrv']])
+            + '\n'.join([f'''
+                DELETE FROM {table}_{mrv.name}_nodes
+                WHERE {' AND '.join([f'{pk.name} = {pk.name}_old' for pk in data['pk']])};
+            ''' for mrv in data['mrv'] if model['rkLayout'] == 'dense'])
             +
             '''
             END
@@ -351,58 +341,17 @@ for table_data in model['tables']:
         ''')
 
 
-        # create insert rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "insert_{table}_rule" AS
-            ON INSERT TO {table}
-            DO INSTEAD SELECT insert_{table}({columns_str(data['all'], name_prefix='NEW.', with_cast=True)})
-        ''')
-
-
-        # create update rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "update_{table}_rule" AS
-            ON UPDATE TO {table}
-            DO INSTEAD SELECT update_{table}(
-                {columns_str(data['all'], name_prefix='NEW.', with_cast=True)},
-                {columns_str(data['all'], name_prefix='OLD.', with_cast=True)})
-        ''')
-
-        # create delete rule
-        cursor.execute(f'''
-            CREATE OR REPLACE RULE "delete_{table}_rule" AS
-            ON DELETE TO {table}
-            DO INSTEAD SELECT delete_{table}({columns_str(data['pk'], name_prefix='OLD.', with_cast=True)})
-        ''')
+        # create the write path of the view (INSTEAD OF trigger or rules)
+        for statement in write_path(model, table,
+                                    columns_str(data['all'], name_prefix='NEW.', with_cast=True),
+                                    columns_str(data['all'], name_prefix='NEW.', with_cast=True) + ', ' +
+                                    columns_str(data['all'], name_prefix='OLD.', with_cast=True),
+                                    columns_str(data['pk'], name_prefix='OLD.', with_cast=True)):
+            cursor.execute(statement)
 
-    # create mrv size function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_size(tablename varchar, columnname varchar, pk varchar) RETURNS int
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret int;
-        BEGIN
-            EXECUTE 'SELECT count(*) FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
-    
-    # create mrv total function
-    cursor.execute('''
-        CREATE OR REPLACE FUNCTION mrv_total(tablename varchar, columnname varchar, pk varchar) RETURNS numeric
-        LANGUAGE plpgsql
-        AS $$
-        DECLARE ret numeric;
-        BEGIN
-            EXECUTE 'SELECT sum(' || columnname || ') FROM ' || tablename || '_' || columnname || ' WHERE ' || pk INTO ret;
-            RETURN ret;
-        END
-        $$;
-    ''')
 
 #inserir não insere porque é um update tem que haver default values
-conn.commit()
-conn.close()
-
-print('Done')
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args()
+    model = load_model(args)
+    convert_model(model, (prepare_table, load_table, index_table, finish_table), ('mrv_size', 'mrv_total'), args)
@@ -0,0 +1,59 @@
+# Fixtures shared by the tests; they need a PostgreSQL server, set with the MRV_TEST_HOST, MRV_TEST_PORT,
+# MRV_TEST_USER, MRV_TEST_PASSWORD and MRV_TEST_DATABASE environment variables (the tables are created in
+# the 'mrv_test' schema, which is dropped at the end of each test), and are skipped without one
+
+import importlib
+import os
+import sys
+
+import psycopg2
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(root)
+sys.path.append(os.path.join(root, 'specialized_structures'))
+sys.path.append(os.path.join(root, 'mrvx_structures', 'ntopk'))
+sys.path.append(os.path.join(root, 'mrvx_structures', 'serial'))
+from converter_utils import apply_defaults, connect, catalog
+
+schema = 'mrv_test'
+
+
+# phases of the converter of a structure (max, oput, topk, ntopk or serial)
+def phases_of(structure):
+    converter = importlib.import_module(f'{structure}_converter')
+    return converter.prepare_table, converter.load_table, converter.index_table, converter.finish_table
+
+
+# model of the tests, with the connection settings of the environment
+@pytest.fixture
+def model():
+    return apply_defaults({
+        'database': os.environ.get('MRV_TEST_DATABASE', 'postgres'),
+        'host': os.environ.get('MRV_TEST_HOST', 'localhost'),
+        'port': int(os.environ.get('MRV_TEST_PORT', 5432)),
+        'user': os.environ.get('MRV_TEST_USER', 'postgres'),
+        'password': os.environ.get('MRV_TEST_PASSWORD', ''),
+        'schema': schema,
+        'initialNodes': 4,
+        'maxNodes': 16,
+    })
+
+
+# a connection to the empty 'mrv_test' schema
+@pytest.fixture
+def db(model):
+    try:
+        conn, cursor = connect(model)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'no PostgreSQL server: {e}')
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}')
+    conn.commit()
+    catalog.clear()
+    yield conn, cursor
+    conn.rollback()
+    cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+    conn.commit()
+    conn.close()
@@ -0,0 +1,99 @@
+# Checks that a checkpointed conversion (converter_utils.convert_table_checkpoint) that fails in the
+# middle of its load is continued by --resume
+# Usage: python3 -m pytest tests
+
+import argparse
+
+import pytest
+
+from conftest import phases_of
+from converter_utils import catalog, convert_model, convert_table_checkpoint, journal_table
+
+table_data = {'name': 'items', 'mrv': ['stock']}
+
+
+@pytest.fixture
+def items(db, model):
+    conn, cursor = db
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, name varchar(20), stock int)')
+    cursor.execute("INSERT INTO items SELECT i, 'n' || i, i FROM generate_series(1, 2000) AS i")
+    cursor.execute(journal_table)
+    conn.commit()
+    model['chunkRows'] = 300
+    return conn, cursor
+
+
+# phases of the max converter whose load fails after 'chunks' chunks
+def failing_phases(chunks):
+    prepare_table, load_table, index_table, finish_table = phases_of('max')
+    loaded = []
+
+    def failing_load(conn, cursor, model, table_data, data, where='TRUE'):
+        if len(loaded) == chunks:
+            raise RuntimeError('injected failure')
+        load_table(conn, cursor, model, table_data, data, where)
+        loaded.append(where)
+
+    return prepare_table, failing_load, index_table, finish_table
+
+
+def journal(cursor):
+    cursor.execute("SELECT step, chunk, position IS NULL, rows FROM mrv_journal WHERE table_name = 'items' "
+                   "ORDER BY step, chunk")
+    return cursor.fetchall()
+
+
+def test_resume_after_failed_load(items, model):
+    conn, cursor = items
+    with pytest.raises(RuntimeError):
+        convert_table_checkpoint(conn, cursor, model, table_data, failing_phases(2))
+    conn.rollback()
+    # the prepare step and the first two chunks are committed, with their rows
+    assert journal(cursor) == [('load', 0, False, 300), ('load', 1, False, 300), ('prepare', 0, True, None)]
+    cursor.execute('SELECT count(*) FROM items_stock')
+    assert cursor.fetchone() == (600 * model['initialNodes'],)
+
+    catalog.clear()
+    convert_table_checkpoint(conn, cursor, model, table_data, phases_of('max'), resume=True)
+    conn.commit()
+    cursor.execute('SELECT count(*), sum(stock) FROM items')
+    assert cursor.fetchone() == (2000, 2000 * 2001 // 2)
+    cursor.execute('SELECT count(*), count(DISTINCT id) FROM items_stock')
+    assert cursor.fetchone() == (2000 * model['initialNodes'], 2000)
+    # the load continues after the last recorded chunk, the last one ending with no position
+    steps = journal(cursor)
+    loads = [step for step in steps if step[0] == 'load']
+    assert [chunk for _, chunk, _, _ in loads] == list(range(len(loads)))
+    assert sum(rows for _, _, _, rows in loads) == 2000
+    assert [last for _, _, last, _ in loads] == [False] * (len(loads) - 1) + [True]
+    assert [step for step, _, _, _ in steps if step != 'load'] == ['finish', 'index', 'prepare']
+
+
+def test_resume_converted_table(items, model):
+    conn, cursor = items
+    convert_table_checkpoint(conn, cursor, model, table_data, phases_of('max'))
+    steps = journal(cursor)
+    # a table already converted is left as it is
+    convert_table_checkpoint(conn, cursor, model, table_data, failing_phases(0), resume=True)
+    conn.commit()
+    assert journal(cursor) == steps
+    cursor.execute('SELECT count(*) FROM items')
+    assert cursor.fetchone() == (2000,)
+
+
+# the command line of a checkpointed conversion of the model
+def args(resume):
+    return argparse.Namespace(jobs=1, ranges=1, online=False, checkpoint=True, resume=resume, catalog=None,
+                              emit_sql=None, ingest=None)
+
+
+def test_resume_command(items, model):
+    conn, cursor = items
+    model['tables'] = [table_data]
+    with pytest.raises(RuntimeError):
+        convert_model(model, failing_phases(2), ('mrv_size', 'mrv_total'), args(False))
+    # the renamed table is not in the catalog any more, but its conversion is in the journal
+    catalog.clear()
+    convert_model(model, phases_of('max'), ('mrv_size', 'mrv_total'), args(True))
+    cursor.execute('SELECT count(*), sum(stock) FROM items')
+    assert cursor.fetchone() == (2000, 2000 * 2001 // 2)
@@ -0,0 +1,78 @@
+# Checks --ingest (converter_utils.ingest_table) against converted tables that already hold some of the
+# ingested keys
+# Usage: python3 -m pytest tests
+
+import psycopg2.errors
+import pytest
+
+from conftest import phases_of
+from converter_utils import convert_table, ingest_table, catalog
+
+
+# the table of the structure, created and converted
+@pytest.fixture
+def converted(request, db, model):
+    structure, create, insert, table_data = request.param
+    conn, cursor = db
+    cursor.execute(create)
+    cursor.execute(insert)
+    phases = phases_of(structure)
+    convert_table(conn, cursor, model, table_data, phases)
+    conn.commit()
+    return conn, cursor, model, table_data, phases
+
+
+def ingest(converted, tmp_path, rows):
+    conn, cursor, model, table_data, phases = converted
+    path = tmp_path / 'rows.csv'
+    path.write_text(rows)
+    catalog.clear()
+    ingest_table(conn, cursor, model, table_data, phases, str(path))
+    conn.commit()
+
+
+ntopk = ('ntopk', 'CREATE TABLE items (id int PRIMARY KEY, pos int, player varchar(20), score int)',
+         "INSERT INTO items SELECT i, 1, 'p' || i, i FROM generate_series(1, 10) AS i",
+         {'name': 'items', 'mrv': ['score'], 'payload': ['player'], 'order': ['pos']})
+max_ = ('max', 'CREATE TABLE items (id int PRIMARY KEY, name varchar(20), stock int)',
+        "INSERT INTO items SELECT i, 'n' || i, i FROM generate_series(1, 10) AS i",
+        {'name': 'items', 'mrv': ['stock']})
+serial = ('serial', 'CREATE TABLE items (id int PRIMARY KEY, name varchar(20), counter int)',
+          "INSERT INTO items SELECT i, 'n' || i, i * 100 FROM generate_series(1, 10) AS i",
+          {'name': 'items', 'mrv': ['counter']})
+
+
+@pytest.mark.parametrize('converted', [ntopk], indirect=True)
+def test_ntopk_existing_keys(converted, tmp_path):
+    conn, cursor = converted[:2]
+    ingest(converted, tmp_path, 'id,pos,player,score\n1,1,best,500\n2,1,low,-1\n20,1,new,7\n')
+    cursor.execute('SELECT id, pos, player, score FROM items WHERE id IN (1, 2, 20) AND pos <= 2 ORDER BY id, pos')
+    assert cursor.fetchall() == [(1, 1, 'best', 500), (1, 2, 'p1', 1),
+                                 (2, 1, 'p2', 2), (2, 2, None, 0),
+                                 (20, 1, 'new', 7), (20, 2, None, 0)]
+    # the existing keys keep their nodes, the new one gets as many
+    cursor.execute('SELECT id, count(*) FROM items_score WHERE id IN (1, 2, 20) GROUP BY id ORDER BY id')
+    assert cursor.fetchall() == [(1, 5), (2, 5), (20, 5)]
+    cursor.execute('SELECT count(*) FROM items_orig')
+    assert cursor.fetchone() == (11,)
+
+
+@pytest.mark.parametrize('converted', [max_], indirect=True)
+def test_max_existing_key(converted, tmp_path):
+    # as an INSERT into the view, a row of an existing key is rejected
+    with pytest.raises(psycopg2.errors.UniqueViolation):
+        ingest(converted, tmp_path, 'id,name,stock\n11,a,1\n3,b,2\n')
+
+
+@pytest.mark.parametrize('converted', [serial], indirect=True)
+def test_serial_without_counter(converted, tmp_path):
+    conn, cursor = converted[:2]
+    ingest(converted, tmp_path, 'id,name\n11,a\n12,b\n')
+    cursor.execute('SELECT * FROM items WHERE id > 10 ORDER BY id')
+    assert cursor.fetchall() == [(11, 'a', 0), (12, 'b', 0)]
+
+
+@pytest.mark.parametrize('converted', [serial], indirect=True)
+def test_unknown_column(converted, tmp_path):
+    with pytest.raises(SystemExit):
+        ingest(converted, tmp_path, 'id,"name) FROM STDIN; DROP TABLE items_orig; --"\n11,a\n')
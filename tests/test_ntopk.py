@@ -0,0 +1,47 @@
+# Checks the indexes kept by the ntopk conversion of a table keyed by (key, order)
+# Usage: python3 -m pytest tests
+
+from conftest import phases_of
+from converter_utils import convert_table
+
+table_data = {'name': 'items', 'mrv': ['score'], 'payload': ['player'], 'order': ['pos']}
+
+
+def test_composite_key_indexes(db, model):
+    conn, cursor = db
+    cursor.execute('CREATE TABLE items (id int, pos int, name varchar(20), player varchar(20), score int, '
+                   'PRIMARY KEY (id, pos))')
+    cursor.execute('CREATE INDEX items_name_idx ON items (name, pos)')
+    cursor.execute('CREATE INDEX items_pos_idx ON items (pos)')
+    cursor.execute("INSERT INTO items SELECT i, p, 'n' || i, 'p' || i || p, i * p "
+                   "FROM generate_series(1, 10) AS i, generate_series(1, 2) AS p")
+    conn.commit()
+    convert_table(conn, cursor, model, table_data, phases_of('ntopk'))
+    conn.commit()
+    # the order column is dropped from the key of the indexes, and the indexes only on it are dropped
+    cursor.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = 'mrv_test' AND tablename = 'items_orig' "
+                   "ORDER BY indexname")
+    assert [index.split(' USING ')[1] for index, in cursor.fetchall()] == ['btree (name)', 'btree (id)']
+    cursor.execute('SELECT id, pos, score, player FROM items WHERE id = 3 AND pos <= 2 ORDER BY pos')
+    assert cursor.fetchall() == [(3, 1, 6, 'p32'), (3, 2, 3, 'p31')]
+
+
+def test_dominated_writes(db, model):
+    conn, cursor = db
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, pos int, player varchar(20), score int)')
+    cursor.execute("INSERT INTO items SELECT i, 1, 'p' || i, i * 10 FROM generate_series(1, 3) AS i")
+    conn.commit()
+    convert_table(conn, cursor, model, table_data, phases_of('ntopk'))
+    conn.commit()
+    cursor.execute('SELECT score FROM items_score WHERE id = 2')
+    scores = [score for score, in cursor.fetchall()]
+    # the writes not above the k-th best value of the key are discarded, the others replace its lowest node
+    for score in (3, 50, 1, 20, 7, 50, -5, 100, 0, 60, 15):
+        cursor.execute("INSERT INTO items (id, pos, player, score) VALUES (2, 1, %s, %s)", (f'w{score}', score))
+        scores = sorted(scores + [score], reverse=True)[:len(scores)]
+    cursor.execute('SELECT score FROM items WHERE id = 2 ORDER BY pos')
+    assert [score for score, in cursor.fetchall()] == scores[:5]
+    cursor.execute("SELECT player FROM items WHERE id = 2 AND pos = 1")
+    assert cursor.fetchone() == ('w100',)
+    cursor.execute('SELECT id, score FROM items WHERE id <> 2 AND pos = 1 ORDER BY id')
+    assert cursor.fetchall() == [(1, 10), (3, 30)]
@@ -0,0 +1,40 @@
+# Checks the nodes of the serial conversion and their refresh
+# Usage: python3 -m pytest tests
+
+import pytest
+
+from conftest import phases_of
+from converter_utils import convert_table
+
+table_data = {'name': 'items', 'mrv': ['counter']}
+
+
+@pytest.fixture
+def items(db):
+    conn, cursor = db
+    cursor.execute('CREATE TABLE items (id int PRIMARY KEY, name varchar(20), counter int)')
+    cursor.execute("INSERT INTO items SELECT i, 'n' || i, CASE WHEN i % 2 = 0 THEN i * 100 END "
+                   "FROM generate_series(1, 6) AS i")
+    conn.commit()
+    return conn, cursor
+
+
+# the counters of the nodes of each key
+def counters(cursor):
+    cursor.execute('SELECT id, array_agg(counter ORDER BY counter) FROM items_counter GROUP BY id ORDER BY id')
+    return dict(cursor.fetchall())
+
+
+@pytest.mark.parametrize('generation', ['python', 'sql'])
+def test_null_counters(items, model, generation):
+    conn, cursor = items
+    model['nodeGeneration'] = generation
+    convert_table(conn, cursor, model, table_data, phases_of('serial'))
+    conn.commit()
+    nodes = model['initialNodes'] - 1
+    # a NULL counter starts at 0, as the counter of a row inserted into the view
+    assert counters(cursor) == {i: [(i * 100 if i % 2 == 0 else 0) + n for n in range(nodes)]
+                                for i in range(1, 7)}
+    cursor.execute("INSERT INTO items VALUES (7, 'n7')")
+    cursor.execute('SELECT counter FROM items_counter WHERE id = 7')
+    assert cursor.fetchall() == [(0,)]
@@ -0,0 +1,181 @@
+# Checks that the views of tables converted with the options of the model return the same rows,
+# after the same writes, as the views of tables converted with the default options
+# Usage: python3 -m pytest tests
+
+import pytest
+
+from conftest import phases_of
+from converter_utils import convert_table
+
+# table of each structure (created as {t}), its rows and the writes applied to its view
+structures = {
+    'max': ('CREATE TABLE {t} (id int PRIMARY KEY, name varchar(20), stock int)',
+            "INSERT INTO {t} SELECT i, 'n' || i, i * 10 FROM generate_series(1, 20) AS i",
+            ["INSERT INTO {t} VALUES (100, 'new', 5)",
+             'UPDATE {t} SET stock = 1000 WHERE id = 3',
+             'UPDATE {t} SET stock = 1 WHERE id = 4',
+             'UPDATE {t} SET stock = stock + 7 WHERE id <= 10',
+             'UPDATE {t} SET stock = 50 WHERE id = 100',
+             "UPDATE {t} SET name = 'renamed' WHERE id = 5",
+             'DELETE FROM {t} WHERE id IN (6, 7)']),
+    'oput': ('CREATE TABLE {t} (id int PRIMARY KEY, name varchar(20), ai_current_price int, stock int)',
+             "INSERT INTO {t} SELECT i, 'n' || i, 10, i * 10 FROM generate_series(1, 20) AS i",
+             ["INSERT INTO {t} VALUES (100, 'new', 1, 5)",
+              'UPDATE {t} SET stock = 1000, ai_current_price = 20 WHERE id = 3',
+              'UPDATE {t} SET stock = 1, ai_current_price = 5 WHERE id = 4',
+              'UPDATE {t} SET stock = stock + 7, ai_current_price = 11 + id WHERE id <= 10',
+              'UPDATE {t} SET stock = 50, ai_current_price = 2 WHERE id = 100',
+              "UPDATE {t} SET name = 'renamed' WHERE id = 5",
+              'DELETE FROM {t} WHERE id IN (6, 7)']),
+    'topk': ('CREATE TABLE {t} (id int PRIMARY KEY, name varchar(20), stock int[])',
+             "INSERT INTO {t} SELECT i, 'n' || i, ARRAY[i, i + 1] FROM generate_series(1, 20) AS i",
+             ["INSERT INTO {t} VALUES (100, 'new', ARRAY[5])",
+              'UPDATE {t} SET stock = ARRAY[1000] WHERE id = 3',
+              "UPDATE {t} SET name = 'renamed' WHERE id = 5",
+              'DELETE FROM {t} WHERE id IN (6, 7)']),
+}
+
+
+# creates the table of the structure as 't' and converts it with the options
+def convert(db, model, structure, t, options):
+    conn, cursor = db
+    create, insert, _ = structures[structure]
+    cursor.execute(create.format(t=t))
+    cursor.execute(insert.format(t=t))
+    convert_table(conn, cursor, dict(model, **options), {'name': t, 'mrv': ['stock']}, phases_of(structure))
+    conn.commit()
+
+
+# the rows of the view of the table after the writes of the structure
+def written(db, structure, t):
+    conn, cursor = db
+    for write in structures[structure][2]:
+        cursor.execute(write.format(t=t))
+    conn.commit()
+    cursor.execute(f'SELECT * FROM {t} ORDER BY id')
+    return cursor.fetchall()
+
+
+# the views written with the default options and with the given ones
+def compare(db, model, structure, options):
+    convert(db, model, structure, 'base', {})
+    convert(db, model, structure, 'items', options)
+    return written(db, structure, 'base'), written(db, structure, 'items')
+
+
+@pytest.mark.parametrize('structure', ['max', 'oput', 'topk'])
+def test_dense_layout(db, model, structure):
+    base, dense = compare(db, model, structure, {'rkLayout': 'dense'})
+    assert dense == base
+    # every key keeps its nodes numbered 0..n-1, with n in <table>_<mrv>_nodes
+    cursor = db[1]
+    cursor.execute('''SELECT count(*) FROM items_stock_nodes AS C
+                      WHERE C.n <> (SELECT count(*) FROM items_stock AS T WHERE T.id = C.id)
+                         OR C.n - 1 <> (SELECT max(rk) FROM items_stock AS T WHERE T.id = C.id)''')
+    assert cursor.fetchone() == (0,)
+
+
+@pytest.mark.parametrize('structure', ['max'])
+def test_max_cache(db, model, structure):
+    convert(db, model, structure, 'base', {})
+    convert(db, model, structure, 'items', {'maxCache': True})
+    cursor = db[1]
+    # keys queued to have their maximum refreshed, one of them deleted
+    cursor.execute('INSERT INTO items_stock_max_dirty VALUES (15), (16)')
+    for t in ('base', 'items'):
+        cursor.execute(f'DELETE FROM {t} WHERE id = 16')
+    assert written(db, structure, 'items') == written(db, structure, 'base')
+    cursor.execute('SELECT id FROM items_stock_max_dirty ORDER BY id')
+    assert cursor.fetchall() == [(15,)]
+    cursor.execute('SELECT refresh_items_stock_max()')
+    cursor.execute('SELECT id, stock FROM items_stock_max ORDER BY id')
+    maxima = cursor.fetchall()
+    cursor.execute('SELECT id, stock FROM base ORDER BY id')
+    assert maxima == cursor.fetchall()
+
+
+@pytest.mark.parametrize('structure', ['max', 'oput'])
+@pytest.mark.parametrize('options', [{'elideWrites': True, 'countElisions': True},
+                                     {'elideWrites': True, 'countElisions': True, 'maxCache': True}])
+def test_elide_writes(db, model, structure, options):
+    base, elided = compare(db, model, structure, options)
+    assert elided == base
+    cursor = db[1]
+    cursor.execute('SELECT writes, elided FROM items_stock_elision')
+    writes, elided = cursor.fetchone()
+    assert writes > 0 and 0 < elided < writes
+
+
+# batches of (keys, values) of the _batch function of the structure: the first keys of each are elided
+batches = {
+    'max': ('SELECT max_{t}_stock_batch(%s, %s)',
+            [([1, 3, 2], [5, 0, 1000]), ([2, 2, 4], [7, 2000, 41])]),
+    'oput': ('SELECT oput_{t}_stock_batch(%s, %s, %s)',
+             [([1, 3, 2], [5, 0, 30], [50, 60, 70]), ([2, 2, 4], [7, 40, 41], [1, 2, 3])]),
+}
+
+
+@pytest.mark.parametrize('structure', ['max', 'oput'])
+def test_elided_batch(db, model, structure):
+    convert(db, model, structure, 'base', {})
+    convert(db, model, structure, 'items', {'elideWrites': True, 'countElisions': True})
+    call, arguments = batches[structure]
+    cursor = db[1]
+    for t in ('base', 'items'):
+        for batch in arguments:
+            cursor.execute(call.format(t=t), batch)
+    cursor.execute('SELECT * FROM base ORDER BY id')
+    base = cursor.fetchall()
+    cursor.execute('SELECT * FROM items ORDER BY id')
+    assert cursor.fetchall() == base
+    # every key of a batch is a write, the ones not above their bound are elided
+    cursor.execute('SELECT writes, elided FROM items_stock_elision')
+    assert cursor.fetchone() == (5, 2)
+
+
+@pytest.mark.parametrize('structure', ['max', 'oput', 'topk'])
+def test_rule_write_path(db, model, structure):
+    base, rules = compare(db, model, structure, {'writePath': 'rule'})
+    assert rules == base
+    cursor = db[1]
+    cursor.execute("SELECT count(*) FROM pg_rules WHERE schemaname = 'mrv_test' AND tablename = 'items'")
+    assert cursor.fetchone() == (3,)
+
+
+# the same writes, one key at a time through the view
+singles = {
+    'max': 'UPDATE {t} SET stock = %s WHERE id = %s',
+    'oput': 'UPDATE {t} SET ai_current_price = %s, stock = %s WHERE id = %s',
+}
+
+
+@pytest.mark.parametrize('structure', ['max', 'oput'])
+def test_batch_writes(db, model, structure):
+    convert(db, model, structure, 'base', {})
+    convert(db, model, structure, 'items', {})
+    call, arguments = batches[structure]
+    cursor = db[1]
+    for batch in arguments:
+        cursor.execute(call.format(t='items'), batch)
+        for write in zip(*batch):
+            cursor.execute(singles[structure].format(t='base'), write[1:] + write[:1])
+    cursor.execute('SELECT * FROM base ORDER BY id')
+    base = cursor.fetchall()
+    cursor.execute('SELECT * FROM items ORDER BY id')
+    assert cursor.fetchall() == base
+
+
+# options of the load of the nodes, the writes then going through the same functions
+load_options = [{'loader': 'insert'}, {'copyFormat': 'binary'}, {'nodeGeneration': 'sql'},
+                {'unloggedLoad': True, 'verifyChecksums': True}]
+
+
+@pytest.mark.parametrize('structure', ['max', 'oput', 'topk'])
+@pytest.mark.parametrize('options', load_options)
+def test_load_options(db, model, structure, options):
+    base, loaded = compare(db, model, structure, options)
+    assert loaded == base
+    # the tables loaded unlogged are logged once converted
+    cursor = db[1]
+    cursor.execute("SELECT count(*) FROM pg_class WHERE relnamespace = 'mrv_test'::regnamespace AND relpersistence = 'u'")
+    assert cursor.fetchone() == (0,)